@@ -1,367 +1,825 @@
-from flask import Flask
+from flask import Flask, Response, g, request, stream_with_context
 from flask_restful import Resource, Api, reqparse
-from config import Config
-from models import User as DB_User,Appointment as DB_Appointment,Calendar as DB_Calendar, UC_Association as DB_UCA, CA_Association as DB_CAA, db
-import secrets, datetime
+from sqlalchemy.orm.attributes import set_committed_value
+import config, database
+from models import User as DB_User,Appointment as DB_Appointment,Calendar as DB_Calendar, UC_Association as DB_UCA, CA_Association as DB_CAA, Change as DB_Change, db, user_graph, association_graph, epoch
+import secrets, datetime, json, base64, re, hashlib
+import freebusy, recurrence, ics
+from busycache import BusyCache
+from bodycache import BodyCache
+from metrics import Metrics
+from jobs import Jobs
 
 app = Flask(__name__)
-app.config.from_object(Config)
+app.config.from_object(config.profile())
 api=Api(app)
 db.init_app(app)
+database.init_app(app)
+busy_cache=BusyCache(app.config["BUSY_CACHE_SIZE"])
+body_cache=BodyCache(app.config["BODY_CACHE_SIZE"])
+jobs=Jobs(app,app.config["JOB_WORKERS"])
+
+if app.config["METRICS_ENABLED"]:
+    metrics=Metrics(app)
+    metrics.register("calendar_busy_cache_hits_total","Busy interval lookups served from the cache.","counter",lambda:busy_cache.stats()["hits"])
+    metrics.register("calendar_busy_cache_misses_total","Busy interval lookups that had to query the database.","counter",lambda:busy_cache.stats()["misses"])
+    metrics.register("calendar_busy_cache_buckets","Weeks of busy intervals held in the cache.","gauge",lambda:busy_cache.stats()["buckets"])
+    metrics.register("calendar_body_cache_hits_total","User and calendar bodies served from the cache.","counter",lambda:body_cache.stats()["hits"])
+    metrics.register("calendar_body_cache_misses_total","User and calendar bodies that had to be loaded and serialized.","counter",lambda:body_cache.stats()["misses"])
+    metrics.register("calendar_jobs_queued","Bulk shares and invitations waiting for a worker.","gauge",lambda:jobs.stats()["queued"])
+    metrics.register("calendar_jobs_running","Bulk shares and invitations being processed.","gauge",lambda:jobs.stats()["running"])
 
 class Users(Resource):
     def get(self):
-        users=[]
-        for user in db.session.query(DB_User).all():
-            users.append(user.to_dict())
-        return {"users":users},200
+        args=parser.parse_args()
+        return listing_response(list_users(args["limit"],args["cursor"],wants_ndjson(),is_readable(args)))
     
     def post(self):
         args=parser.parse_args()
-        user_name=args["user"]
-        if user_name == None:
-            return "Error! No argument 'user' provided.",400
-        
-        if db.session.query(DB_User).filter(DB_User.name==user_name).scalar() is not None:
-            return "Error! User '"+user_name+"' already exists.",404
-
-        new_user=DB_User(name=user_name,secret=secrets.token_hex(nbytes=4))
-        db.session.add(new_user)
-        db.session.commit()
-
-        return {
-            'user':new_user.to_dict(),
-            'secret':new_user.secret
-        },200
+        return create_user(args["user"])
 
 class User(Resource):
     def get(self,user_name):
-        if not user_exists(user_name):
-            return "User '"+user_name+"' is not in the system",404
-        return db.session.query(DB_User).filter(DB_User.name==user_name).first().to_dict(),200
+        args=parser.parse_args()
+        return show_user(user_name,request.headers.get("If-None-Match"),is_readable(args))
 
     def post(self,user_name):
-        if not user_exists(user_name):
-            return "User '"+user_name+"' is not in the system",404
-
         args=parser.parse_args()
-        calendar_name=args["calendar"]
-        if calendar_name == None:
-            return "Error! No argument 'calendar' provided",400
-
-        if db.session.query(DB_Calendar).filter(DB_Calendar.owned_by==user_name,DB_Calendar.name==calendar_name).scalar() is not None:
-            return "Error! User '"+user_name+"' already has a calendar named '"+calendar_name+"'. Please choose a unique calendar name.",400
-        
-        new_calendar=DB_Calendar(name=calendar_name,owned_by=user_name)
-        db.session.add(new_calendar)
-        db.session.commit()
-
-        #retrieve the system identifier from the previously created calendar
-        calendar_id=db.session.query(DB_Calendar).filter(DB_Calendar.owned_by==user_name,DB_Calendar.name==calendar_name).first().id
-        
-        #if user has now default calendar yet, the new calendar will be the default.
-        status="own"
-        if db.session.query(DB_UCA).filter(DB_UCA.user_name==user_name,DB_UCA.status=="default").scalar() is None:
-            status="default"
-
-        new_association=DB_UCA(user_name=user_name,calendar_id=new_calendar.id,status=status)
-        db.session.add(new_association)
-        db.session.commit()
-
-        return {
-            'calendar':new_calendar.to_dict()
-        },200
+        return create_calendar(user_name,args["calendar"])
 
 class Appointment(Resource):
     def get(self,user_name,calendar_name):
-        if not user_exists(user_name):
-            return "User '"+user_name+"' is not in the system",404
-        
-        if db.session.query(DB_Calendar).filter(DB_Calendar.owned_by==user_name,DB_Calendar.name==calendar_name).scalar() is None:
-            return "Error! User '"+user_name+"' does not own a calendar named '"+calendar_name+"'.",400
-        
-        return db.session.query(DB_Calendar).filter(DB_Calendar.owned_by==user_name,DB_Calendar.name==calendar_name).first().to_dict()["appointments"],200
+        if wants_calendar():
+            return calendar_response(list_calendar(user_name,calendar_name,stream=True),calendar_name)
+        args=parser.parse_args()
+        return listing_response(list_calendar(user_name,calendar_name,args["limit"],args["cursor"],wants_ndjson(),is_readable(args),request.headers.get("If-None-Match")))
     
     def post(self,user_name,calendar_name):
-        if not user_exists(user_name):
-            return "User '"+user_name+"' is not in the system",404
-        
-        if db.session.query(DB_Calendar).filter(DB_Calendar.owned_by==user_name,DB_Calendar.name==calendar_name).scalar() is None:
-            return "Error! User '"+user_name+"' does not own a calendar named '"+calendar_name+"'.",400
+        #an iCalendar text is imported while it is uploaded
+        if request.mimetype=="text/calendar":
+            return import_calendar(user_name,calendar_name,iter(lambda:request.stream.read(65536),b""))
+
+        #a JSON array of appointments is imported as a batch
+        batch=request.get_json(silent=True)
+        if isinstance(batch,list):
+            return save_appointments(user_name,calendar_name,batch)
         
         args=parser.parse_args()
-        name,start,duration=args["name"],args["start"],args["dur"]
-
-        if name == None or start == None or duration == None:
-            return "Error! Make sure to provide the arguments 'name', 'start', and 'dur'",400
-
-        start=datetime.datetime.fromtimestamp(start)
-        calendar_id=db.session.query(DB_Calendar).filter(DB_Calendar.owned_by==user_name,DB_Calendar.name==calendar_name).first().id
-
-        #check against existing records in DB, in which case the write operation is an update.
-        existing_appointment=check_appointment(name,start,calendar_id)
-        if existing_appointment!=None:
-            existing_appointment.date=start
-            existing_appointment.duration=duration
-            db.session.commit()
-            return {
-                "type":"update",
-                "appointment":existing_appointment.to_dict()
-                },200
-                      
-        #print(f"Start comparison date: {start_comp}\nEnd comparison date: {end_comp}\nActual date: {start}")
-        new_appointment=DB_Appointment(name=name,date=start,duration=duration,origin_id=calendar_id)
-        db.session.add(new_appointment)
-        db.session.commit()
-
-        appointment_id=check_appointment(name,start,calendar_id).id
-        new_association=DB_CAA(calendar_id=calendar_id,appointment_id=appointment_id,status="host")
-        db.session.add(new_association)
-        db.session.commit()
-        
-        return {
-            "type":"insertion",
-            "appointment":new_appointment.to_dict()
-        },200
+        return save_appointment(user_name,calendar_name,args["name"],args["start"],args["dur"],args["repeat"],args["count"],args["until"],args["except"])
 
     def delete(self,user_name,calendar_name):
-        if not user_exists(user_name):
-            return "User '"+user_name+"' is not in the system",404
-        
-        if db.session.query(DB_Calendar).filter(DB_Calendar.owned_by==user_name,DB_Calendar.name==calendar_name).scalar() is None:
-            return "Error! User '"+user_name+"' does not own a calendar named '"+calendar_name+"'.",400
-        
         args=parser.parse_args()
-        name,start=args["name"],args["start"]
-
-        if name == None or start == None:
-            return "Error! Make sure to provide the identifying arguments 'name' and 'start'",400
-
-        start=datetime.datetime.utcfromtimestamp(start)
-        calendar_id=db.session.query(DB_Calendar).filter(DB_Calendar.owned_by==user_name,DB_Calendar.name==calendar_name).first().id 
-
-        existing_appointment=check_appointment(name,start,calendar_id)
-        if existing_appointment==None:
-            return f"Error! The requested appointment with 'name' == {name} and 'date' == {start} does not exist in this calendar or you do not have the permission to delete it.",400
-
-        db.session.delete(existing_appointment)
-        db.session.commit()
-        return {
-            "type":"deletion",
-            "appointment":existing_appointment.to_dict()
-        },200
+        return delete_appointment(user_name,calendar_name,args["name"],args["start"])
 
 class Search(Resource):
     def get(self,user_name):
-        if not user_exists(user_name):
-            return "User '"+user_name+"' is not in the system",404
-        return {"appointments":find_appointments(user_name)}       
+        args=parser.parse_args()
+        return listing_response(list_user_appointments(user_name,args["limit"],args["cursor"],wants_ndjson(),is_readable(args)))
 
     def post(self,user_name):
-        if not user_exists(user_name):
-            return "User '"+user_name+"' is not in the system",404
-
         args=parser.parse_args()
-        appointment_name=args["name"]
-        
-        return {"appointments":find_appointments(user_name,appointment_name)},200
+        return search_appointments(user_name,args["name"],args["start"],args["days_ahead"],is_readable(args))
 
 class Availability(Resource):
     def post(self,user_name):
-        if not user_exists(user_name):
-            return "User '"+user_name+"' is not in the system",404
-        
-        args=parser.parse_args()
-        booked_user=args["user"]
-        days_ahead=args["days_ahead"]
-
-        if days_ahead==None:
-            days_ahead=7
-
-        if booked_user==None:
-            return "Error! You must specify a user that you want to book an appointment with by passing the argument 'user'",400
-
-        if not user_exists(booked_user):
-            return f"Error! The user '{booked_user}' you want to book an appointment with does not exist in the system",404
-
-        if user_name==booked_user:
-            return f"Error! You cannot book an appointment with yourself",400
-
-        #the allowed time for bookings is anywhere from now to the days ahead provided in the request (by default 7)
-        start_time=datetime.datetime.now()
-        end_time=start_time+datetime.timedelta(days=days_ahead)
-
-        #retrieve the appointments of the booking and the booked user within the corresponding timeframe
-        booking=find_appointments(user_name,None,start_time,end_time)
-        booked=find_appointments(booked_user,None,start_time,end_time)
-
-        booking_user=db.session.query(DB_User).filter(DB_User.name==user_name).first()
-        booked_user=db.session.query(DB_User).filter(DB_User.name==booked_user).first()
-
-        starting_point=datetime.datetime.min
-        earliest_td=max(booking_user.avail_start,booked_user.avail_start)-starting_point
-        latest_td=min(booking_user.avail_end,booked_user.avail_end)-starting_point
-
-        time_slots={}   
-        i,j=0,0
-        while(start_time<end_time):
-            available=[]
-            weekday=start_time.weekday()
-            midnight=start_time.replace(hour=0,minute=0,second=0,microsecond=0)
-            earliest=midnight+earliest_td
-            latest=midnight+latest_td
-            if weekday>4:
-                start_time+=datetime.timedelta(days=1)
-                continue
-            if booking_user.avail_days[weekday]=="n" or booked_user.avail_days[weekday]=="n":
-                time_slots[start_time.strftime("%Y/%m/%d")]=available
-                start_time+=datetime.timedelta(days=1)
-                continue
-            unix_earliest=earliest.timestamp()
-            unix_latest=latest.timestamp()
-
-            # while len(booking)>i and booking[i]["datestamp"]<unix_earliest:
-            #     curr=booking[i]["datestamp"]+booking[i]["duration"]*60+booking_user.buffer*60
-            #     if curr>unix_earliest:
-            #         unix_earliest=datetime.datetime.fromtimestamp(curr)
-            #     i+=1
-            # while len(booked)>j and booked[j]["datestamp"]<unix_earliest:
-            #     curr=booked[j]["datestamp"]+booking[j]["duration"]*60+booked_user.buffer*60
-            #     if curr>unix_earliest:
-            #         unix_earliest=datetime.datetime.fromtimestamp(curr)
-            #     j+=1
-
-            if i == len(booking) and j == len(booked):
-                if unix_earliest<unix_latest:
-                    available.append([unix_to_time(unix_earliest),unix_to_time(unix_latest)])
-                time_slots[start_time.strftime("%Y/%m/%d")]=available
-                start_time+=datetime.timedelta(days=1)
-                continue
+        args=availability_parser.parse_args()
+        return find_availability(user_name,args["user"],args["days_ahead"])
 
-            next_booking,next_booked=unix_latest,unix_latest
-            while i != len(booking) or j != len(booked):
-                print(f"i = {i}, j = {j}, lengths of lists: {len(booking),len(booked)}")
-                if i<len(booking):
-                    next_booking=min(booking[i]["datestamp"]-booking_user.buffer*60,unix_latest)
-                else:
-                    next_booking=unix_latest
-                if j<len(booking):
-                    next_booked=min(booked[j]["datestamp"]-booked_user.buffer*60,unix_latest)
-                else:
-                    next_booked=unix_latest
-                print(f"next booking: {unix_to_time(next_booking)}, next booked: {unix_to_time(next_booked)}.")
-                if min(next_booking,next_booked)>unix_earliest:
-                    available.append([unix_to_time(unix_earliest),unix_to_time(min(next_booking,next_booked))])
-                if next_booking >= unix_latest and next_booked >= unix_latest:
-                    break
-                if next_booking<next_booked:
-                    unix_earliest=next_booking+(booking[i]["duration"]+2*booking_user.buffer)*60
-                    i+=1
-                else:
-                    unix_earliest=next_booked+(booked[j]["duration"]+2*booked_user.buffer)*60
-                    j+=1
-            
-            # if unix_earliest<unix_latest:
-            #     available.append([unix_to_time(unix_earliest),unix_to_time(unix_latest)])
-
-            time_slots[start_time.strftime("%Y/%m/%d")]=available
-            start_time+=datetime.timedelta(days=1)
-    
-        return time_slots,200
+class TeamAvailability(Resource):
+    def post(self):
+        args=availability_parser.parse_args()
+        return find_team_availability(args["user"],args["days_ahead"])
 
 class Booking(Resource):
     def post(self,user_name,calendar_name):
-        if not user_exists(user_name):
-            return "User '"+user_name+"' is not in the system",404
-        
-        if db.session.query(DB_Calendar).filter(DB_Calendar.owned_by==user_name,DB_Calendar.name==calendar_name).scalar() is None:
-            return "Error! User '"+user_name+"' does not own a calendar named '"+calendar_name+"'.",400
-        
         args=parser.parse_args()
-        booked_user=args["user"]
-        name,start,duration=args["name"],args["start"],args["dur"]
-
-        if booked_user==None:
-            return "Error! You must specify a user that you want to book an appointment with by passing the argument 'user'",400
-        
-        if name == None or start == None or duration == None:
-            return "Error! Make sure to provide the arguments 'name', 'start', and 'dur'",400
-
-        unix_start=start
-        unix_end=start+duration*60
-
-        search_start=datetime.datetime.fromtimestamp(unix_start).replace(hour=0,minute=0,second=0,microsecond=0)
-        search_end=search_start+datetime.timedelta(days=1)
-
-        booking=db.session.query(DB_User).filter(DB_User.name==user_name).first()
-        booked=db.session.query(DB_User).filter(DB_User.name==booked_user).first()
-        if booked==None:
-            return f"Error! The user '{booked_user}' you are trying to set up an appointment with does not exist in the system.'"
+        return book_appointment(user_name,calendar_name,args["user"],args["name"],args["start"],args["dur"])
 
-        appointments_booking=find_appointments(user_name,None,search_start,search_end)
-        appointments_booked=find_appointments(booked_user,None,search_start,search_end)
-
-        if not slot_available(booking,appointments_booking,unix_start,unix_end):
-            return f"Error! User '{user_name}' is not free at the requested slot",400
-
-        if not slot_available(booked,appointments_booked,unix_start,unix_end):
-            return f"Error! User '{booked_user}' is not free at the requested slot",400
+class Sharing(Resource):
+    def post(self,user_name,calendar_name):
+        args=parser.parse_args()
+        return share_calendar(user_name,calendar_name,args["user"])
 
+class BulkSharing(Resource):
+    def post(self,user_name,calendar_name):
+        args=availability_parser.parse_args()
+        return bulk_share_calendar(user_name,calendar_name,args["user"])
 
-        #retrieve the system identifier from the previously created calendar
-        calendar_id=db.session.query(DB_Calendar).filter(DB_Calendar.owned_by==user_name,DB_Calendar.name==calendar_name).first().id
-        start_dt=datetime.datetime.fromtimestamp(start)
+class BulkInvitation(Resource):
+    def post(self,user_name,calendar_name):
+        args=availability_parser.parse_args()
+        return bulk_invite(user_name,calendar_name,args["user"],args["name"],args["start"])
 
-        new_appointment=DB_Appointment(name=name,date=start_dt,duration=duration,origin_id=calendar_id)
-        db.session.add(new_appointment)
-        db.session.commit()
+class Job(Resource):
+    def get(self,job_id):
+        return show_job(job_id)
 
-        #find guest default calendar
-        guest_calendar_id=db.session.query(DB_UCA).filter(DB_UCA.user_name==booked_user,DB_UCA.status=="default").first().calendar_id
+class Sync(Resource):
+    def get(self,user_name):
+        args=parser.parse_args()
+        return sync_user(user_name,args["since"],args["limit"],is_readable(args))
 
-        appointment_id=check_appointment(name,start_dt,calendar_id).id
-        new_association_host=DB_CAA(calendar_id=calendar_id,appointment_id=appointment_id,status="host")
-        new_association_guest=DB_CAA(calendar_id=guest_calendar_id,appointment_id=appointment_id,status="pending")
-        db.session.add(new_association_host)
-        db.session.add(new_association_guest)
+class Stats(Resource):
+    def get(self):
+        return {"busy_cache":busy_cache.stats(),"body_cache":body_cache.stats(),"jobs":jobs.stats()},200
+
+#the operations behind the resources take the validated arguments of a request and return (body, status[, headers]),
+#so they serve the Flask resources above as well as the ASGI app in asgi.py
+
+def list_users(limit=None,cursor=None,stream=False,readable=True):
+    """Function returns all users as listing, paged by name if argument limit or cursor is passed.
+    Without readable, appointment times are only given as unix timestamps, see Appointment.to_dict."""
+    query=db.session.query(DB_User).options(user_graph())
+    if limit is not None or cursor is not None:
+        query=query.order_by(DB_User.name)
+        if cursor is not None:
+            after=decode_cursor(cursor,1)
+            if after is None:
+                return "Error! The argument 'cursor' is not a valid cursor.",400
+            query=query.filter(DB_User.name>after[0])
+    return page(query,limit,stream,lambda user:user.to_dict(readable),lambda user:[user.name],"users")
+
+def create_user(user_name):
+    """Function creates the user with the provided name and returns it together with its secret."""
+    if user_name == None:
+        return "Error! No argument 'user' provided.",400
+    
+    if resolve_user(user_name) is not None:
+        return "Error! User '"+user_name+"' already exists.",404
+
+    #the user starts without calendars, which spares loading them for the response
+    new_user=DB_User(name=user_name,secret=secrets.token_hex(nbytes=4),calendars=[])
+    db.session.add(new_user)
+    db.session.flush()
+
+    #responses are serialized before the commit, which would expire the loaded objects
+    response={
+        'user':new_user.to_dict(),
+        'secret':new_user.secret
+    }
+    db.session.commit()
+    return response,200
+
+def show_user(user_name,if_none_match=None,readable=True):
+    """Function returns the user with its calendars and their appointments, or status 304 without a body if if_none_match
+    holds the current ETag of the user. Serialized users are served from the body cache as long as their ETag stays the same."""
+    etag=user_etag(user_name,readable)
+    if etag is None:
+        return "User '"+user_name+"' is not in the system",404
+    if etag_matches(if_none_match,etag):
+        return None,304,{"ETag":etag}
+    serialize=lambda:load_user(user_name).to_dict(readable)
+    return body_cache.body(("user",user_name,etag),serialize),200,{"ETag":etag}
+
+def create_calendar(user_name,calendar_name):
+    """Function creates a calendar owned by the user, which becomes the user's default calendar if the user has none yet."""
+    if not user_exists(user_name):
+        return "User '"+user_name+"' is not in the system",404
+
+    if calendar_name == None:
+        return "Error! No argument 'calendar' provided",400
+
+    if resolve_calendar(user_name,calendar_name) is not None:
+        return "Error! User '"+user_name+"' already has a calendar named '"+calendar_name+"'. Please choose a unique calendar name.",400
+    
+    #if user has now default calendar yet, the new calendar will be the default.
+    status="own"
+    if default_calendar_id(user_name) is None:
+        status="default"
+
+    #flushing the calendar assigns its system identifier, which the association refers to
+    new_calendar=DB_Calendar(name=calendar_name,owned_by=user_name,appointments=[])
+    db.session.add(new_calendar)
+    db.session.flush()
+
+    new_association=DB_UCA(user_name=user_name,calendar_id=new_calendar.id,status=status)
+    db.session.add(new_association)
+    log_change("calendar",new_calendar.id)
+    touch_users([user_name])
+    response={
+        'calendar':new_calendar.to_dict()
+    }
+    db.session.commit()
+    return response,200
+
+def list_calendar(user_name,calendar_name,limit=None,cursor=None,stream=False,readable=True,if_none_match=None):
+    """Function returns the appointments of the calendar as listing, paged by start date if argument limit or cursor is passed.
+    The complete listing as JSON document carries the ETag of the calendar and is served like show_user."""
+    if not user_exists(user_name):
+        return "User '"+user_name+"' is not in the system",404
+
+    calendar=resolve_calendar(user_name,calendar_name)
+    if calendar is None:
+        return "Error! User '"+user_name+"' does not own a calendar named '"+calendar_name+"'.",400
+
+    if limit is None and cursor is None and not stream:
+        etag=make_etag(["calendar",calendar.id,calendar.version,readable])
+        if etag_matches(if_none_match,etag):
+            return None,304,{"ETag":etag}
+        serialize=lambda:load_appointments(calendar).to_dict(readable)["appointments"]
+        return body_cache.body(("calendar",calendar.id,etag),serialize),200,{"ETag":etag}
+
+    query=db.session.query(DB_Appointment,DB_CAA.status)\
+        .join(DB_CAA,DB_CAA.appointment_id==DB_Appointment.id)\
+        .filter(DB_CAA.calendar_id==calendar.id)\
+        .order_by(DB_Appointment.date,DB_Appointment.id)
+    query=after_appointment_cursor(query,cursor)
+    if query is None:
+        return "Error! The argument 'cursor' is not a valid cursor.",400
+    return page(query,limit,stream,lambda row:appointment_row(row,readable),appointment_key)
+
+def save_appointment(user_name,calendar_name,name,start,duration,repeat=None,count=None,until=None,exceptions=None):
+    """Function inserts the appointment into the calendar or updates the appointment with the same name on the same day."""
+    if not user_exists(user_name):
+        return "User '"+user_name+"' is not in the system",404
+    
+    if resolve_calendar(user_name,calendar_name) is None:
+        return "Error! User '"+user_name+"' does not own a calendar named '"+calendar_name+"'.",400
+
+    if name == None or start == None or duration == None:
+        return "Error! Make sure to provide the arguments 'name', 'start', and 'dur'",400
+
+    rule,error=recurrence_rule(repeat,count,until,exceptions)
+    if error is not None:
+        return error,400
+
+    #an existing appointment with the same name on the same day is updated, otherwise the appointment is inserted.
+    calendar_id=resolve_calendar(user_name,calendar_name).id
+    results=upsert_appointments(calendar_id,[(name,freebusy.from_unix(start),duration,rule)])
+    kind,appointment=results[0]
+    log_upserts(results)
+    affected=users_of([calendar_id],[appointment.id] if kind=="update" else [])
+    touch_calendars([calendar_id],[appointment.id] if kind=="update" else [])
+    response={
+        "type":kind,
+        "appointment":appointment.to_dict()
+    }
+    db.session.commit()
+    invalidate_busy(affected)
+    return response,200
+
+def save_appointments(user_name,calendar_name,batch):
+    """Upserts a list of appointments given as objects with the keys 'name', 'start' and 'dur' in a single transaction.
+    The optional keys 'repeat', 'count', 'until' and 'except' set the recurrence rule like the arguments of a single appointment."""
+    if not user_exists(user_name):
+        return "User '"+user_name+"' is not in the system",404
+    
+    if resolve_calendar(user_name,calendar_name) is None:
+        return "Error! User '"+user_name+"' does not own a calendar named '"+calendar_name+"'.",400
+
+    items=[]
+    for index,item in enumerate(batch):
+        if not isinstance(item,dict) or not isinstance(item.get("name"),str) or type(item.get("start")) is not int or type(item.get("dur")) is not int:
+            return f"Error! Appointment {index} of the batch must provide the arguments 'name' (string), 'start' and 'dur' (integers)",400
+        exceptions=item.get("except")
+        if not isinstance(item.get("repeat"),(str,type(None))) or not all(type(item.get(key)) in (int,type(None)) for key in ("count","until")) \
+                or not (exceptions is None or (isinstance(exceptions,list) and all(type(day) is int for day in exceptions))):
+            return f"Error! Appointment {index} of the batch has an invalid recurrence rule",400
+        rule,error=recurrence_rule(item.get("repeat"),item.get("count"),item.get("until"),exceptions)
+        if error is not None:
+            return f"{error} (appointment {index} of the batch)",400
+        items.append((item["name"],freebusy.from_unix(item["start"]),item["dur"],rule))
+
+    calendar_id=resolve_calendar(user_name,calendar_name).id
+    results=upsert_appointments(calendar_id,items)
+    log_upserts(results)
+    updated=[appointment.id for kind,appointment in results if kind=="update"]
+    affected=users_of([calendar_id],updated)
+    touch_calendars([calendar_id],updated)
+    db.session.commit()
+    invalidate_busy(affected)
+    return {
+        "type":"batch",
+        "appointments":[{"type":kind,"appointment":appointment.to_dict()} for kind,appointment in results]
+    },200
+
+def import_calendar(user_name,calendar_name,chunks):
+    """Function upserts the events of an iCalendar text, given as iterator of byte chunks, into the calendar like save_appointments.
+    The text is parsed while it is read and committed in batches of ICS_IMPORT_BATCH events, so memory use does not depend on its size.
+    Events that cannot be imported are skipped, the reasons for the first 10 of them are returned."""
+    if not user_exists(user_name):
+        return "User '"+user_name+"' is not in the system",404
+
+    if resolve_calendar(user_name,calendar_name) is None:
+        return "Error! User '"+user_name+"' does not own a calendar named '"+calendar_name+"'.",400
+
+    calendar_id=resolve_calendar(user_name,calendar_name).id
+    counts={"insertion":0,"update":0,"skipped":0}
+    errors=[]
+
+    def commit(items):
+        results=upsert_appointments(calendar_id,items)
+        log_upserts(results)
+        updated=[appointment.id for kind,appointment in results if kind=="update"]
+        affected=users_of([calendar_id],updated)
+        touch_calendars([calendar_id],updated)
         db.session.commit()
-        return{
-            "type":"invitation",
-            "appointment":new_association_guest.to_dict()
-        },200
+        database.forget_recorded_queries()
+        invalidate_busy(affected)
+        for kind,_ in results:
+            counts[kind]+=1
+
+    items=[]
+    try:
+        for item,error in ics.events(chunks):
+            if error is not None:
+                counts["skipped"]+=1
+                if len(errors)<10:
+                    errors.append(error)
+                continue
+            items.append(item)
+            if len(items)>=app.config["ICS_IMPORT_BATCH"]:
+                commit(items)
+                items=[]
+    except ValueError as error:
+        #only raised before the first event, so nothing has been committed
+        return f"Error! {error}",400
+    if len(items)>0:
+        commit(items)
+
+    return {
+        "type":"import",
+        "inserted":counts["insertion"],
+        "updated":counts["update"],
+        "skipped":counts["skipped"],
+        "errors":errors
+    },200
+
+def delete_appointment(user_name,calendar_name,name,start):
+    """Function deletes the appointment with the name on the day of start from the calendar."""
+    if not user_exists(user_name):
+        return "User '"+user_name+"' is not in the system",404
+    
+    if resolve_calendar(user_name,calendar_name) is None:
+        return "Error! User '"+user_name+"' does not own a calendar named '"+calendar_name+"'.",400
+
+    if name == None or start == None:
+        return "Error! Make sure to provide the identifying arguments 'name' and 'start'",400
+
+    start=freebusy.from_unix(start)
+    calendar_id=resolve_calendar(user_name,calendar_name).id
+
+    existing_appointment=check_appointment(name,start,calendar_id)
+    if existing_appointment==None:
+        return f"Error! The requested appointment with 'name' == {name} and 'date' == {start} does not exist in this calendar or you do not have the permission to delete it.",400
+
+    #the associations are deleted along with the appointment, so the affected users are determined before
+    affected=users_of([calendar_id],[existing_appointment.id])
+    touch_calendars([calendar_id],[existing_appointment.id])
+    log_appointments("deletion",[existing_appointment.id])
+    db.session.delete(existing_appointment)
+    db.session.commit()
+    invalidate_busy(affected)
+    return {
+        "type":"deletion",
+        "appointment":existing_appointment.to_dict()
+    },200
+
+def list_user_appointments(user_name,limit=None,cursor=None,stream=False,readable=True):
+    """Function returns the appointments of all calendars of the user as listing, sorted and paged by start date."""
+    if not user_exists(user_name):
+        return "User '"+user_name+"' is not in the system",404
+
+    query=after_appointment_cursor(appointment_query(user_name),cursor)
+    if query is None:
+        return "Error! The argument 'cursor' is not a valid cursor.",400
+    return page(query,limit,stream,lambda row:appointment_row(row,readable),appointment_key,"appointments")
+
+def search_appointments(user_name,appointment_name=None,start=None,days_ahead=None,readable=True):
+    """Function searches the appointments of the user by name, ranked by the full-text index where available."""
+    if not user_exists(user_name):
+        return "User '"+user_name+"' is not in the system",404
+
+    #with 'days_ahead', the search covers the occurrences from now (or 'start') to the days ahead
+    min_start,max_start=None,None
+    if days_ahead is not None:
+        min_start=freebusy.from_unix(start) if start is not None else datetime.datetime.utcnow()
+        max_start=min_start+datetime.timedelta(days=days_ahead)
+
+    query=fulltext_query(user_name,appointment_name) if appointment_name is not None else None
+    if query is None:
+        return {"appointments":find_appointments(user_name,appointment_name,min_start,max_start,readable)},200
+    if min_start is not None:
+        query=query.filter(window_filter(min_start,max_start))
+    return {"appointments":expand_rows(query,min_start,max_start,readable,ranked=True)},200
+
+def find_availability(user_name,booked_users,days_ahead=None):
+    """Function returns the common free slots of the user and the booked users per day, from now to the days ahead."""
+    if not user_exists(user_name):
+        return "User '"+user_name+"' is not in the system",404
+
+    if days_ahead==None:
+        days_ahead=7
+
+    if booked_users==None:
+        return "Error! You must specify the users that you want to book an appointment with by passing the argument 'user' once per user",400
+
+    #the booking user is always a participant, duplicates are dropped while keeping the order of the request
+    names=list(dict.fromkeys([user_name]+booked_users))
+    if len(names)==1:
+        return f"Error! You cannot book an appointment with yourself",400
+
+    participants={user.name:user for user in db.session.query(DB_User).filter(DB_User.name.in_(names))}
+    for name in names:
+        if name not in participants:
+            return f"Error! The user '{name}' you want to book an appointment with does not exist in the system",404
+    users=[participants[name] for name in names]
+
+    #the allowed time for bookings is anywhere from now to the days ahead provided in the request (by default 7)
+    start_time=datetime.datetime.utcnow()
+    end_time=start_time+datetime.timedelta(days=days_ahead)
+
+    intervals=[busy_intervals(name,start_time,end_time) for name in names]
+
+    time_slots={}
+    for day,slots in freebusy.availability(users,intervals,start_time,end_time):
+        time_slots[day.strftime("%Y/%m/%d")]=[[unix_to_time(start),unix_to_time(end)] for start,end in slots]
+    return time_slots,200
+
+def find_team_availability(user_names,days_ahead=None):
+    """Function returns the common free slots per day of the whole team of users and of every pair of them, from now to the days ahead.
+    The slots of a pair are listed under the name of the user that comes first in the request."""
+    if user_names==None:
+        return "Error! You must specify the users of the team by passing the argument 'user' once per user",400
+
+    if days_ahead==None:
+        days_ahead=7
+
+    #duplicates are dropped while keeping the order of the request
+    names=list(dict.fromkeys(user_names))
+    if len(names)==1:
+        return "Error! A team consists of at least two users",400
+
+    members={user.name:user for user in db.session.query(DB_User).filter(DB_User.name.in_(names))}
+    for name in names:
+        if name not in members:
+            return f"Error! The user '{name}' is not in the system",404
+    users=[members[name] for name in names]
+
+    start_time=datetime.datetime.utcnow()
+    end_time=start_time+datetime.timedelta(days=days_ahead)
+
+    intervals=[busy_intervals(name,start_time,end_time) for name in names]
+    group,pairs=freebusy.team_availability(users,intervals,start_time,end_time)
+
+    days=[day.strftime("%Y/%m/%d") for day,_ in freebusy.working_windows(users,start_time,end_time)]
+    #the slots of the pairs share most of their bounds, each timestamp is formatted once
+    labels={}
+    def label(timestamp):
+        if timestamp not in labels:
+            labels[timestamp]=(freebusy.from_unix(timestamp).strftime("%Y/%m/%d"),unix_to_time(timestamp))
+        return labels[timestamp]
+    def per_day(slots):
+        time_slots={day:[] for day in days}
+        for start,end in slots:
+            day,first=label(start)
+            time_slots[day].append([first,label(end)[1]])
+        return time_slots
+
+    matrix={name:{} for name in names[:-1]}
+    for (i,j),slots in pairs.items():
+        matrix[names[i]][names[j]]=per_day(slots)
+    return {"group":per_day(group),"pairs":matrix},200
+
+def book_appointment(user_name,calendar_name,booked_user,name,start,duration):
+    """Function books an appointment in the calendar and invites the booked user to it, if both users are free at the slot.
+    The slot is checked against the busy cache first and checked again against the database after the users that see one of the
+    calendars are locked, so concurrent bookings involving one of them are serialized, while bookings of distinct users are not."""
+    if not user_exists(user_name):
+        return "User '"+user_name+"' is not in the system",404
+    
+    if resolve_calendar(user_name,calendar_name) is None:
+        return "Error! User '"+user_name+"' does not own a calendar named '"+calendar_name+"'.",400
 
-class Sharing(Resource):
-    def post(self,user_name,calendar_name):
-        if not user_exists(user_name):
-            return "User '"+user_name+"' is not in the system",404
-        
-        if db.session.query(DB_Calendar).filter(DB_Calendar.owned_by==user_name,DB_Calendar.name==calendar_name).scalar() is None:
-            return "Error! User '"+user_name+"' does not own a calendar named '"+calendar_name+"'.",400
-        
-        args=parser.parse_args()
-        shared_name=args["user"]
-        if shared_name==None:
-            return f"Error! You must provide a user you want to share the calendar with by setting the argument 'user'",400
-        
-        shared_user=db.session.query(DB_User).filter(DB_User.name==shared_name).first()
-        if shared_user==None:
-            return f"Error! The user '{shared_user}' you are trying to share a calendar with does not exist in the system.'"
-        
-        calendar_id=db.session.query(DB_Calendar).filter(DB_Calendar.owned_by==user_name,DB_Calendar.name==calendar_name).first().id
-        shared_association=DB_UCA(user_name=shared_name,calendar_id=calendar_id,status="pending")
-        db.session.add(shared_association)
-        db.session.commit()
-        return{
-            "type":"calendar invite",
-            "calendar":shared_association.to_dict()
-        },200
+    if booked_user==None:
+        return "Error! You must specify a user that you want to book an appointment with by passing the argument 'user'",400
+    
+    if name == None or start == None or duration == None:
+        return "Error! Make sure to provide the arguments 'name', 'start', and 'dur'",400
+
+    start_dt=freebusy.from_unix(start)
+    unix_start=start
+    unix_end=unix_start+duration*60
+
+    search_start=start_dt.replace(hour=0,minute=0,second=0,microsecond=0)
+    search_end=search_start+datetime.timedelta(days=1)
+
+    booking=resolve_user(user_name)
+    booked=resolve_user(booked_user)
+    if booked==None:
+        return f"Error! The user '{booked_user}' you are trying to set up an appointment with does not exist in the system.'"
+
+    intervals_booking=busy_intervals(user_name,search_start,search_end)
+    intervals_booked=busy_intervals(booked_user,search_start,search_end)
+
+    if not slot_available(booking,intervals_booking,unix_start,unix_end):
+        return f"Error! User '{user_name}' is not free at the requested slot",400
+
+    if not slot_available(booked,intervals_booked,unix_start,unix_end):
+        return f"Error! User '{booked_user}' is not free at the requested slot",400
+
+
+    #find guest default calendar
+    guest_calendar_id=default_calendar_id(booked_user)
+    if guest_calendar_id is None:
+        return f"Error! The user '{booked_user}' does not have a calendar to receive the invitation.",400
+
+    calendar_id=resolve_calendar(user_name,calendar_name).id
+    affected=users_of([calendar_id,guest_calendar_id])
+
+    #the cache may miss bookings that committed since it was filled, the slot is checked again within the lock
+    lock_users(affected|{user_name,booked_user})
+    first,last=freebusy.to_unix(search_start),freebusy.to_unix(search_end)
+    for user in (booking,booked):
+        if not slot_available(user,load_busy(user.name,first,last,locking=True),unix_start,unix_end):
+            db.session.rollback()
+            return f"Error! User '{user.name}' is not free at the requested slot",400
+
+    #flushing the appointment assigns its system identifier, which the associations refer to
+    new_appointment=DB_Appointment(name=name,date=start_dt,duration=duration,origin_id=calendar_id)
+    db.session.add(new_appointment)
+    db.session.flush()
+
+    new_association_host=DB_CAA(calendar_id=calendar_id,appointment_id=new_appointment.id,status="host")
+    new_association_guest=DB_CAA(calendar_id=guest_calendar_id,appointment=new_appointment,status="pending")
+    db.session.add(new_association_host)
+    db.session.add(new_association_guest)
+    log_change("insertion",calendar_id,new_appointment)
+    log_change("invitation",guest_calendar_id,new_appointment)
+    touch_calendars([calendar_id,guest_calendar_id])
+    response={
+        "type":"invitation",
+        "appointment":new_association_guest.to_dict()
+    }
+    db.session.commit()
+    invalidate_busy(affected)
+    return response,200
+
+def share_calendar(user_name,calendar_name,shared_name):
+    """Function invites the shared user to the calendar."""
+    if not user_exists(user_name):
+        return "User '"+user_name+"' is not in the system",404
+    
+    if resolve_calendar(user_name,calendar_name) is None:
+        return "Error! User '"+user_name+"' does not own a calendar named '"+calendar_name+"'.",400
+    
+    if shared_name==None:
+        return f"Error! You must provide a user you want to share the calendar with by setting the argument 'user'",400
+    
+    shared_user=resolve_user(shared_name)
+    if shared_user==None:
+        return f"Error! The user '{shared_user}' you are trying to share a calendar with does not exist in the system.'"
+    
+    calendar=load_appointments(resolve_calendar(user_name,calendar_name))
+    shared_association=DB_UCA(user_name=shared_name,calendar=calendar,status="pending")
+    db.session.add(shared_association)
+    log_change("calendar invite",calendar.id,user_name=shared_name)
+    touch_users([shared_name])
+    response={
+        "type":"calendar invite",
+        "calendar":shared_association.to_dict()
+    }
+    db.session.commit()
+    busy_cache.invalidate(shared_name)
+    return response,200
+
+def bulk_share_calendar(user_name,calendar_name,shared_names):
+    """Function validates a share of the calendar with many users and queues it as a job, returned with status 202 right away.
+    The job invites the users in batches of JOB_BATCH, one transaction each, users that do not exist or already see the calendar are skipped."""
+    if not user_exists(user_name):
+        return "User '"+user_name+"' is not in the system",404
+
+    if resolve_calendar(user_name,calendar_name) is None:
+        return "Error! User '"+user_name+"' does not own a calendar named '"+calendar_name+"'.",400
+
+    if not shared_names:
+        return "Error! You must provide the users you want to share the calendar with by repeating the argument 'user'",400
+
+    calendar_id=resolve_calendar(user_name,calendar_name).id
+    shared_names=list(dict.fromkeys(shared_names))
+
+    def work(progress):
+        counts,errors={"shared":0,"skipped":0},[]
+        batch=app.config["JOB_BATCH"]
+        for i in range(0,len(shared_names),batch):
+            names=shared_names[i:i+batch]
+            existing={name for name, in db.session.query(DB_User.name).filter(DB_User.name.in_(names))}
+            #the users are locked before their associations are read, so a concurrent share cannot insert the same association
+            lock_users(existing)
+            associated={name for name, in db.session.query(DB_UCA.user_name).filter(DB_UCA.calendar_id==calendar_id,DB_UCA.user_name.in_(names))}
+            new=[]
+            for name in names:
+                if name not in existing:
+                    error=f"user '{name}' does not exist"
+                elif name in associated:
+                    error=f"user '{name}' already sees the calendar"
+                else:
+                    new.append(name)
+                    continue
+                counts["skipped"]+=1
+                if len(errors)<10:
+                    errors.append(error)
+            db.session.bulk_insert_mappings(DB_UCA,[{"user_name":name,"calendar_id":calendar_id,"status":"pending"} for name in new])
+            db.session.bulk_insert_mappings(DB_Change,[{"kind":"calendar invite","calendar_id":calendar_id,"user_name":name} for name in new])
+            db.session.commit()
+            database.forget_recorded_queries()
+            invalidate_busy(new)
+            counts["shared"]+=len(new)
+            progress(i+len(names))
+        return dict(counts,errors=errors)
+
+    job=jobs.submit("calendar invite",len(shared_names),work)
+    return job_response(job)
+
+def bulk_invite(user_name,calendar_name,guest_names,name,start):
+    """Function validates the invitation of many users to the appointment with the name on the day of start and queues it as a job,
+    returned with status 202 right away. The job adds the appointment to the default calendars of the guests in batches of JOB_BATCH,
+    one transaction each, guests that do not exist, have no calendar or already have the appointment are skipped.
+    The job stops if the appointment is deleted before or while it runs."""
+    if not user_exists(user_name):
+        return "User '"+user_name+"' is not in the system",404
+
+    if resolve_calendar(user_name,calendar_name) is None:
+        return "Error! User '"+user_name+"' does not own a calendar named '"+calendar_name+"'.",400
+
+    if not guest_names:
+        return "Error! You must provide the users you want to invite by repeating the argument 'user'",400
+
+    if name == None or start == None:
+        return "Error! Make sure to provide the arguments 'name' and 'start' of the appointment",400
+
+    appointment=check_appointment(name,freebusy.from_unix(start),resolve_calendar(user_name,calendar_name).id)
+    if appointment is None:
+        return f"Error! The calendar '{calendar_name}' has no appointment named '{name}' on the day of the timestamp '{start}'.",400
+
+    #the job runs in its own session, it refers to the appointment by its columns only
+    appointment_id,appointment_name,start_epoch,origin_id=appointment.id,appointment.name,appointment.start_epoch,appointment.origin_id
+    guest_names=list(dict.fromkeys(guest_names))
+
+    def work(progress):
+        counts,errors={"invited":0,"skipped":0},[]
+        batch=app.config["JOB_BATCH"]
+        for i in range(0,len(guest_names),batch):
+            names=guest_names[i:i+batch]
+            existing={name for name, in db.session.query(DB_User.name).filter(DB_User.name.in_(names))}
+            calendars={}
+            for guest,calendar_id in db.session.query(DB_UCA.user_name,DB_UCA.calendar_id).filter(DB_UCA.user_name.in_(names),DB_UCA.status=="default"):
+                calendars.setdefault(guest,calendar_id)
+            #the calendars are locked by bumping their versions before their associations are read, like the users of a booking.
+            #The calendar of the appointment is locked as well, as deleting the appointment bumps its version too.
+            touch_calendars(set(calendars.values())|{origin_id})
+            if db.session.query(DB_Appointment.id).filter(DB_Appointment.id==appointment_id).first() is None:
+                db.session.rollback()
+                #the remaining guests are not counted as skipped, the job did not get to them
+                return dict(counts,errors=errors+[f"appointment '{appointment_name}' was deleted, the guests from '{names[0]}' on were not invited"])
+            invited={calendar_id for calendar_id, in db.session.query(DB_CAA.calendar_id).filter(DB_CAA.appointment_id==appointment_id,DB_CAA.calendar_id.in_(list(calendars.values())))}
+            new=set()
+            for guest in names:
+                if guest not in existing:
+                    error=f"user '{guest}' does not exist"
+                elif guest not in calendars:
+                    error=f"user '{guest}' does not have a calendar to receive the invitation"
+                elif calendars[guest] in invited or calendars[guest] in new:
+                    error=f"user '{guest}' already has the appointment"
+                else:
+                    new.add(calendars[guest])
+                    continue
+                counts["skipped"]+=1
+                if len(errors)<10:
+                    errors.append(error)
+            db.session.bulk_insert_mappings(DB_CAA,[{"calendar_id":calendar_id,"appointment_id":appointment_id,"status":"pending"} for calendar_id in new])
+            db.session.bulk_insert_mappings(DB_Change,[{"kind":"invitation","calendar_id":calendar_id,"appointment_id":appointment_id,"name":appointment_name,"start_epoch":start_epoch} for calendar_id in new])
+            affected=users_of(new)
+            db.session.commit()
+            database.forget_recorded_queries()
+            invalidate_busy(affected)
+            counts["invited"]+=len(new)
+            progress(i+len(names))
+        return dict(counts,errors=errors)
+
+    job=jobs.submit("invitation",len(guest_names),work)
+    return job_response(job)
+
+def show_job(job_id):
+    """Function returns the state and progress of a job, and its result once it is done."""
+    job=jobs.get(job_id)
+    if job is None:
+        return f"Job '{job_id}' does not exist or has expired",404
+    return job.to_dict(),200
+
+def job_response(job):
+    """returns the response to a request that queued the job, which points to its status."""
+    return {"type":"job","job":job.to_dict()},202,{"Location":f"/jobs/{job.id}"}
+
+def sync_user(user_name,since=None,limit=None,readable=True):
+    """Function returns the changes to the calendars of the user logged after the token since, oldest first, and the token to pass next.
+    Without since, only the current token is returned, which clients fetch before downloading the user in full.
+    At most limit changes (default 1000) are returned, 'more' tells whether further changes follow. Several changes of an appointment
+    within them are reported once, with the current state of the appointment.
+    The token is the id of the last change returned, which is only correct where changes commit in id order. SQLite serializes
+    all writes, so they do. On MySQL and PostgreSQL a transaction may commit after one holding a larger id, and a client that
+    synced in between would skip its changes for good. Sync is therefore only supported on SQLite."""
+    if not user_exists(user_name):
+        return "User '"+user_name+"' is not in the system",404
+
+    if limit is None:
+        limit=1000
+    if limit<1:
+        return "Error! The argument 'limit' must be positive.",400
+
+    if since is None:
+        latest=db.session.query(db.func.max(DB_Change.id)).scalar() or 0
+        return {"token":encode_cursor([latest]),"changes":[],"more":False},200
+
+    key=decode_cursor(since,1)
+    if key is None or type(key[0]) is not int:
+        return "Error! The argument 'since' is not a valid token.",400
+
+    rows=db.session.query(DB_Change,DB_Calendar.name,DB_Calendar.owned_by)\
+        .join(DB_UCA,DB_UCA.calendar_id==DB_Change.calendar_id)\
+        .join(DB_Calendar,DB_Calendar.id==DB_Change.calendar_id)\
+        .filter(DB_UCA.user_name==user_name,DB_Change.id>key[0],db.or_(DB_Change.user_name==None,DB_Change.user_name==user_name))\
+        .order_by(DB_Change.id).limit(limit+1).all()
+    more=len(rows)>limit
+    rows=rows[:limit]
+    token=encode_cursor([rows[-1][0].id if len(rows)>0 else key[0]])
+
+    #the last change of an appointment in a calendar decides its position, an insertion or invitation followed by updates stays one.
+    #A deletion ends the appointment, changes after it with the same id belong to another one and are not folded into it.
+    changes={}
+    for change,calendar_name,owner in rows:
+        identity=(change.calendar_id,change.appointment_id) if change.appointment_id is not None else change.id
+        kind=change.kind
+        if identity in changes:
+            previous=changes.pop(identity)[0]
+            if kind=="update":
+                kind=previous
+        if kind=="deletion":
+            changes[change.id]=(kind,change,{"name":calendar_name,"owner":owner})
+        else:
+            changes[identity]=(kind,change,{"name":calendar_name,"owner":owner})
+
+    #current state of the appointments, with their status in the changed calendar
+    current=list({change.appointment_id for kind,change,_ in changes.values() if change.appointment_id is not None and kind!="deletion"})
+    associations={}
+    for i in range(0,len(current),500):
+        for association in db.session.query(DB_CAA).options(db.joinedload(DB_CAA.appointment)).filter(DB_CAA.appointment_id.in_(current[i:i+500])):
+            associations[(association.calendar_id,association.appointment_id)]=association
+
+    result=[]
+    for identity,(kind,change,calendar) in changes.items():
+        entry={"type":kind,"calendar":calendar}
+        if kind=="deletion":
+            entry["appointment"]={"name":change.name,"datestamp":float(change.start_epoch) if readable else change.start_epoch}
+        elif change.appointment_id is not None:
+            association=associations.get(identity)
+            #the appointment was deleted after the returned changes, its deletion follows on the next page
+            if association is None:
+                continue
+            entry["appointment"]=association.to_dict(readable)
+        result.append(entry)
+    return {"token":token,"changes":result,"more":more},200
 
 def user_exists(name):
     """Function checks whether user with name exists in system"""
-    if db.session.query(DB_User).filter(DB_User.name==name).scalar() is None:
+    if resolve_user(name) is None:
         return False
     return True
 
+def resolve_user(name):
+    """Function returns the user with the provided name or None if the user does not exist.
+    Users are loaded at most once per request and kept on flask.g for the following lookups."""
+    users=g.setdefault("users",{})
+    if name not in users:
+        users[name]=db.session.query(DB_User).filter(DB_User.name==name).first()
+    return users[name]
+
+def resolve_calendar(user_name,calendar_name):
+    """Function returns the calendar with the provided name owned by the user or None if there is no such calendar.
+    Calendars are loaded at most once per request and kept on flask.g for the following lookups."""
+    calendars=g.setdefault("calendars",{})
+    if (user_name,calendar_name) not in calendars:
+        calendars[(user_name,calendar_name)]=db.session.query(DB_Calendar).filter(DB_Calendar.owned_by==user_name,DB_Calendar.name==calendar_name).first()
+    return calendars[(user_name,calendar_name)]
+
+def load_user(user_name):
+    """Function returns the user with everything serialized by User.to_dict loaded. The user comes from resolve_user,
+    usually without a query after user_etag, its calendars and their appointments are loaded with two queries."""
+    user=resolve_user(user_name)
+    associations=db.session.query(DB_UCA).options(association_graph()).filter(DB_UCA.user_name==user_name).order_by(DB_UCA.calendar_id).all()
+    set_committed_value(user,"calendars",associations)
+    return user
+
+def load_appointments(calendar):
+    """Function loads everything serialized by Calendar.to_dict into the calendar with one query and returns the calendar."""
+    associations=db.session.query(DB_CAA).options(db.joinedload(DB_CAA.appointment)).filter(DB_CAA.calendar_id==calendar.id).order_by(DB_CAA.appointment_id).all()
+    set_committed_value(calendar,"appointments",associations)
+    return calendar
+
+def default_calendar_id(user_name):
+    """returns the id of the user's default calendar or None if the user has no calendar yet."""
+    return db.session.query(DB_UCA.calendar_id).filter(DB_UCA.user_name==user_name,DB_UCA.status=="default").limit(1).scalar()
+
 def check_appointment(name,start,calendar_id):
     """Function returns the result for a query on appointments with given name, start time on the same day as the time provided and calendar_id.
     The combination of these three attributes function as identifying tuple for the appointment relation."""
@@ -369,77 +827,432 @@ def check_appointment(name,start,calendar_id):
     end_comp=start_comp+datetime.timedelta(hours=24)
     return db.session.query(DB_Appointment).filter(DB_Appointment.name==name,DB_Appointment.date>=start_comp,DB_Appointment.date<end_comp,DB_Appointment.origin_id==calendar_id).first()
 
-def find_appointments(user_name,substring=None,min_start=datetime.datetime.min,max_start=datetime.datetime.max):
+def recurrence_rule(repeat,count=None,until=None,exceptions=None):
+    """Function validates the recurrence arguments of a request, with until and exceptions given as unix timestamps.
+    Returns (rule, error): rule maps the recurrence columns of the appointment to their values, None if no repeat was requested.
+    repeat 'none' turns a recurring appointment back into a single one."""
+    if repeat is None:
+        return None,None
+    if repeat=="none":
+        return {"repeat":None,"repeat_count":None,"repeat_until":None,"repeat_except":None},None
+    if repeat not in recurrence.FREQUENCIES:
+        return None,f"Error! The argument 'repeat' must be one of {', '.join(recurrence.FREQUENCIES)} or none"
+    if count is not None and count<1:
+        return None,"Error! The argument 'count' must be positive"
+    return {
+        "repeat":repeat,
+        "repeat_count":count,
+        "repeat_until":freebusy.from_unix(until) if until is not None else None,
+        "repeat_except":recurrence.format_exceptions({freebusy.from_unix(day).date() for day in exceptions or []})
+    },None
+
+def upsert_appointments(calendar_id,items):
+    """Function inserts or updates the (name, start, duration, rule) items in the calendar, identified like in check_appointment
+    by name, day of start and calendar. rule holds the recurrence columns as returned by recurrence_rule, None keeps the rule of
+    an existing appointment and inserts a single appointment. Existing appointments are loaded with one query per 500 names, new appointments
+    and their CA_Association rows are written with bulk inserts. The caller commits the transaction.
+    Returns a list of ("insertion"|"update", appointment) in the order of items."""
+    if len(items)==0:
+        return []
+    first=min(start for _,start,_,_ in items).replace(hour=0,minute=0,second=0,microsecond=0)
+    last=max(start for _,start,_,_ in items).replace(hour=0,minute=0,second=0,microsecond=0)+datetime.timedelta(days=1)
+    names=list({name for name,_,_,_ in items})
+
+    existing={}
+    for i in range(0,len(names),500):
+        for appointment in db.session.query(DB_Appointment).filter(DB_Appointment.origin_id==calendar_id,DB_Appointment.name.in_(names[i:i+500]),DB_Appointment.date>=first,DB_Appointment.date<last):
+            existing.setdefault((appointment.name,appointment.date.date()),appointment)
+
+    results,new_appointments=[],[]
+    for name,start,duration,rule in items:
+        appointment=existing.get((name,start.date()))
+        if appointment is not None:
+            appointment.date=start
+            appointment.duration=duration
+            for column,value in (rule or {}).items():
+                setattr(appointment,column,value)
+            results.append(("update",appointment))
+            continue
+        appointment=DB_Appointment(name=name,date=start,duration=duration,origin_id=calendar_id,**(rule or {}))
+        existing[(name,start.date())]=appointment
+        new_appointments.append(appointment)
+        results.append(("insertion",appointment))
+
+    #new appointments are written after the loop, so items updating an appointment inserted by the same batch are part of the insert
+    db.session.bulk_save_objects(new_appointments,return_defaults=True)
+    db.session.bulk_insert_mappings(DB_CAA,[{"calendar_id":calendar_id,"appointment_id":appointment.id,"status":"host"} for appointment in new_appointments])
+    return results
+
+def appointment_query(user_name,substring=None,min_start=None,max_start=None):
+    """Function returns the query for all (appointment, status) rows associated with the calendars associated with the provided user,
+    sorted by start date. If argument substring is passed, only those appointments that contain substring in its name are selected.
+    If min_start or max_start are passed, only appointments that can have an occurrence between them are selected, recurring
+    appointments still have to be expanded with expand_rows. Joining, filtering, deduplication and sorting are done in a single SQL statement."""
+    #an appointment can be reached through several calendars of the user, in which case it is only returned once.
+    #"host" sorts before "pending", so the host status wins over an invitation to the same appointment.
+    query=db.session.query(DB_Appointment,db.func.min(DB_CAA.status))\
+        .join(DB_CAA,DB_CAA.appointment_id==DB_Appointment.id)\
+        .join(DB_UCA,DB_UCA.calendar_id==DB_CAA.calendar_id)\
+        .filter(DB_UCA.user_name==user_name)
+    if min_start is not None or max_start is not None:
+        query=query.filter(window_filter(min_start,max_start))
+    if substring is not None:
+        query=query.filter(db.func.lower(DB_Appointment.name).contains(substring.lower(),autoescape=True))
+    return query.group_by(DB_Appointment.id).order_by(DB_Appointment.date,DB_Appointment.id)
+
+def fulltext_query(user_name,text):
+    """Function returns the query for the (appointment, status) rows of the user whose names contain words starting with each word of text,
+    ranked by relevance. Returns None if the database has no full-text index or text contains no words, in which case
+    callers fall back to the substring search of find_appointments."""
+    words=re.findall(r"\w+",text)
+    if len(words)==0 or not has_fulltext():
+        return None
+    #every word is quoted, so that FTS5 operators in the search text are matched literally, and used as prefix
+    match=" ".join('"'+word+'"*' for word in words)
+    ranked=db.text("SELECT rowid AS id, rank FROM appointment_fts WHERE appointment_fts MATCH :match")\
+        .bindparams(match=match).columns(id=db.Integer,rank=db.Float).alias("ranked")
+    return db.session.query(DB_Appointment,db.func.min(DB_CAA.status))\
+        .join(ranked,ranked.c.id==DB_Appointment.id)\
+        .join(DB_CAA,DB_CAA.appointment_id==DB_Appointment.id)\
+        .join(DB_UCA,DB_UCA.calendar_id==DB_CAA.calendar_id)\
+        .filter(DB_UCA.user_name==user_name)\
+        .group_by(DB_Appointment.id).order_by(ranked.c.rank,DB_Appointment.date,DB_Appointment.id)
+
+#whether the full-text index exists, per engine
+fulltext_engines={}
+
+def has_fulltext():
+    """checks whether the full-text index created by the migrations exists in the database."""
+    engine=db.engine
+    if engine not in fulltext_engines:
+        fulltext_engines[engine]=engine.dialect.name=="sqlite" and engine.has_table("appointment_fts")
+    return fulltext_engines[engine]
+
+def window_filter(min_start=None,max_start=None):
+    """Function returns the SQL condition for appointments with an occurrence that can lie between the datetimes min_start and max_start.
+    Recurring appointments are selected if their series has started before max_start and has not ended before min_start."""
+    #single appointments are selected through the index on their start timestamp
+    single,recurring=[DB_Appointment.repeat==None],[DB_Appointment.repeat!=None]
+    if min_start is not None:
+        single.append(DB_Appointment.start_epoch>=epoch(min_start))
+        recurring.append(db.or_(DB_Appointment.repeat_until==None,DB_Appointment.repeat_until>=min_start))
+    if max_start is not None:
+        single.append(DB_Appointment.start_epoch<=epoch(max_start))
+        recurring.append(DB_Appointment.date<=max_start)
+    return db.or_(db.and_(*single),db.and_(*recurring))
+
+def find_appointments(user_name,substring=None,min_start=None,max_start=None,readable=True):
     """Function returns all appointments associated with the calendars associated with the provided user.
-    If argument substring is passed, only those appointments that contain substring in its name will be returned."""
-    name_search=True
-    if substring == None:
-        name_search=False
-
+    If argument substring is passed, only those appointments that contain substring in its name will be returned.
+    If min_start or max_start are passed, recurring appointments are returned once per occurrence between them,
+    otherwise once with their recurrence rule."""
+    return expand_rows(appointment_query(user_name,substring,min_start,max_start),min_start,max_start,readable)
+
+def expand_rows(rows,min_start=None,max_start=None,readable=True,ranked=False):
+    """Function serializes (appointment, status) rows. Within a window given by min_start and max_start, every occurrence of a
+    recurring appointment becomes its own entry and the entries are sorted by start date, otherwise rows keep their order.
+    Ranked rows keep their order within a window as well, with the occurrences of an appointment in a row by start date."""
+    if min_start is None and max_start is None:
+        return [appointment_row(row,readable) for row in rows]
     appointments=[]
-    calendars=db.session.query(DB_User).filter(DB_User.name==user_name).first().calendars
-    for calendar in calendars:
-        for appointment in calendar.calendar.appointments:
-            if appointment not in appointments:
-                curr=appointment.appointment
-                if curr.date>=min_start and curr.date<=max_start and (not name_search or substring.lower() in curr.name.lower()):
-                    appointments.append(appointment.to_dict())
-    
-    #sort the appointments in order of their start date
-    appointments.sort(key=lambda x:x["datestamp"])
+    for appointment,status in rows:
+        if appointment.repeat is None:
+            appointments.append(appointment_row((appointment,status),readable))
+            continue
+        for start in appointment.occurrences(min_start,max_start):
+            serialized=appointment.to_dict(start,readable)
+            serialized["status"]=status
+            appointments.append(serialized)
+    if not ranked:
+        appointments.sort(key=lambda x:x["datestamp"])
     return appointments
 
+def appointment_row(row,readable=True):
+    """serializes an (appointment, status) row in the same shape as CA_Association.to_dict."""
+    appointment,status=row
+    appointment=appointment.to_dict(readable=readable)
+    appointment["status"]=status
+    return appointment
+
+def appointment_key(row):
+    """returns the keyset pagination key (date, id) of an (appointment, status) row."""
+    return [row[0].date.isoformat(),row[0].id]
+
+def after_appointment_cursor(query,cursor):
+    """Function restricts a query sorted by (date, id) to the rows after the cursor. Returns None if the cursor is invalid."""
+    if cursor is None:
+        return query
+    after=decode_cursor(cursor,2)
+    if after is None:
+        return None
+    try:
+        date,appointment_id=datetime.datetime.fromisoformat(after[0]),int(after[1])
+    except (TypeError,ValueError):
+        return None
+    return query.filter(db.or_(DB_Appointment.date>date,db.and_(DB_Appointment.date==date,DB_Appointment.id>appointment_id)))
+
+def encode_cursor(key):
+    """encodes the sort key of the last row of a page as opaque cursor."""
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+def decode_cursor(cursor,length):
+    """decodes a cursor created by encode_cursor for a sort key with length columns. Returns None if the cursor is malformed."""
+    try:
+        key=json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        return None
+    if not isinstance(key,list) or len(key)!=length:
+        return None
+    return key
+
+class Listing(object):
+    """Listing holds the rows of a listing together with their serializer, so the web framework can render them
+    either as a single JSON document or line by line as newline delimited JSON."""
+    def __init__(self,rows,serialize,wrap=None):
+        self.rows=rows
+        self.serialize=serialize
+        self.wrap=wrap
+
+    def document(self):
+        """returns the serialized rows as JSON list, wrapped into {wrap: list} if wrap was passed."""
+        serialized=[self.serialize(row) for row in self.rows]
+        return {self.wrap:serialized} if self.wrap is not None else serialized
+
+    def lines(self):
+        """yields one serialized row per line."""
+        for row in self.rows:
+            yield json.dumps(self.serialize(row))+"\n"
+
+def page(query,limit,stream,serialize,key,wrap=None):
+    """Function returns the rows of a keyset paginated query as (Listing, status, headers).
+    If argument limit is passed, at most limit rows are returned and the cursor to the next page is sent in the header 'X-Next-Cursor'.
+    Complete listings that are streamed are read from a server side cursor, so memory use does not depend on the number of rows."""
+    headers={}
+    if limit is not None:
+        if limit<1:
+            return "Error! The argument 'limit' must be positive.",400
+        #one row more than requested tells whether there is a next page
+        rows=query.limit(limit+1).all()
+        if len(rows)>limit:
+            rows=rows[:limit]
+            headers["X-Next-Cursor"]=encode_cursor(key(rows[-1]))
+    elif stream:
+        rows=query.yield_per(100)
+    else:
+        rows=query.all()
+    return Listing(rows,serialize,wrap),200,headers
+
+def is_readable(args):
+    """checks whether appointment times are requested as formatted dates along with the timestamps, argument 'dates' is 'readable' (default) or 'epoch'."""
+    return args["dates"]!="epoch"
+
+def wants_ndjson():
+    """checks whether the client prefers newline delimited JSON over a single JSON document."""
+    return request.accept_mimetypes.best_match(["application/json","application/x-ndjson"])=="application/x-ndjson"
+
+def wants_calendar():
+    """checks whether the client prefers an iCalendar text over JSON."""
+    return request.accept_mimetypes.best_match(["application/json","text/calendar"])=="text/calendar"
+
+def calendar_response(result,calendar_name):
+    """Function turns the result of a listing operation over appointments into a Flask response streaming the iCalendar text of the calendar.
+    The text is sent in chunks while the rows are read from the cursor."""
+    if not isinstance(result[0],Listing):
+        return result
+    listing,status,headers=result
+    return Response(stream_with_context(ics.export(calendar_name,(appointment for appointment,_ in listing.rows))),status=status,mimetype="text/calendar",headers=headers)
+
+def listing_response(result):
+    """Function turns the result of a listing operation into the Flask response. Clients that accept 'application/x-ndjson'
+    get one JSON document per line, everybody else gets a JSON document."""
+    if not isinstance(result[0],Listing):
+        return result
+    listing,status,headers=result
+    if wants_ndjson():
+        return Response(stream_with_context(listing.lines()),status=status,mimetype="application/x-ndjson",headers=headers)
+    return listing.document(),status,headers
+
 def unix_to_time(timestamp):
     """converts a unix timestamp to a time in the format HH:MM."""
-    return datetime.datetime.fromtimestamp(timestamp).strftime("%H:%M")
+    return freebusy.from_unix(timestamp).strftime("%H:%M")
 
-def slot_available(user,appointments,unix_start,unix_end):
-    start,end=datetime.datetime.fromtimestamp(unix_start),datetime.datetime.fromtimestamp(unix_end)
+def slot_available(user,intervals,unix_start,unix_end):
+    """checks whether the slot between the timestamps unix_start and unix_end lies within the daily availability of the user
+    and keeps the buffer of the user to all of the user's busy intervals."""
+    start=freebusy.from_unix(unix_start)
     weekday=start.weekday()
-    midnight=start.replace(hour=0,minute=0,second=0,microsecond=0).timestamp()
+    midnight=freebusy.to_unix(start.replace(hour=0,minute=0,second=0,microsecond=0))
 
     #appointment is at unavailable day or the weekend
     if weekday > 4 or user.avail_days[weekday]=="n":
         return False
     
     #appointment starts before the user's daily availability begins
-    if unix_start-midnight < user.avail_start.replace(tzinfo=datetime.timezone.utc).timestamp():
-        print("problem here")
+    if unix_start-midnight < freebusy.time_of_day(user.avail_start).total_seconds():
         return False
 
     #appointment ends after the user's daily availability has ended
-    if unix_end-midnight > user.avail_end.replace(year=1970,tzinfo=datetime.timezone.utc).timestamp():
-        print("problem there")
-        print(unix_end-midnight,user.avail_end.replace(year=1970,tzinfo=datetime.timezone.utc).timestamp())
+    if unix_end-midnight > freebusy.time_of_day(user.avail_end).total_seconds():
         return False
 
-    for appointment in appointments:
-        ds=appointment["datestamp"]
-        dur=appointment["duration"]
-        #the planned appointment starts when another one is ongoing
-        if unix_start-user.buffer*60>ds and unix_start-user.buffer*60<ds+dur*60:
-            return False
-
-        #the planned appointment ends when another one is ongoing
-        if unix_end+user.buffer*60>ds and unix_end+user.buffer*60<ds+dur*60:
-            return False
-
-        #the planned appointment encapsulates an existing appointment
-        if ds >= unix_start-user.buffer*60  and ds <=unix_end+user.buffer*60:
+    #the planned appointment overlaps with an existing appointment including the buffer
+    pad=user.buffer*60
+    for start,end in intervals:
+        if start-pad<unix_end and end+pad>unix_start:
             return False
     
     return True
-    
 
+#longest duration of an appointment in seconds, as stored in a SmallInteger of minutes
+MAX_DURATION=32767*60
+
+def load_busy(user_name,first,last,locking=False):
+    """Function returns the sorted (start, end) timestamps of all appointments of the user that overlap with the timestamps first to last.
+    With locking, the appointments are read with a locking read, which sees the latest committed rows instead of the snapshot of the
+    transaction on MySQL. SQLite has no locking reads and always sees them, as its write lock is held by the booking already."""
+    window_start,window_end=freebusy.from_unix(first),freebusy.from_unix(last)
+    query=db.session.query(DB_Appointment.id,DB_Appointment.start_epoch,DB_Appointment.end_epoch,DB_Appointment.date,DB_Appointment.duration,
+            DB_Appointment.repeat,DB_Appointment.repeat_count,DB_Appointment.repeat_until,DB_Appointment.repeat_except)\
+        .join(DB_CAA,DB_CAA.appointment_id==DB_Appointment.id)\
+        .join(DB_UCA,DB_UCA.calendar_id==DB_CAA.calendar_id)\
+        .filter(DB_UCA.user_name==user_name,busy_filter(first,last))\
+        .distinct()
+    if locking:
+        query=query.with_for_update(read=True)
+    intervals=[]
+    for _,start,end,date,duration,repeat,count,until,exceptions in query:
+        #single appointments come with their timestamps, recurring appointments are expanded within the window only,
+        #including the occurrences that start up to their duration before it
+        if repeat is None:
+            intervals.append((start,end))
+            continue
+        for occurrence in recurrence.occurrences(date,repeat,count,until,recurrence.parse_exceptions(exceptions),
+                window_start-datetime.timedelta(minutes=duration),window_end):
+            start=freebusy.to_unix(occurrence)
+            if start<last and start+duration*60>first:
+                intervals.append((start,start+duration*60))
+    intervals.sort()
+    return intervals
+
+def busy_filter(first,last):
+    """Function returns the SQL condition for appointments with an occurrence that overlaps with the timestamps first to last.
+    Single appointments are selected through the index on their end and start timestamps."""
+    single=db.and_(DB_Appointment.repeat==None,DB_Appointment.end_epoch>first,DB_Appointment.start_epoch<last)
+    #the series may have ended up to the longest duration before the window and still overlap into it
+    recurring=db.and_(DB_Appointment.repeat!=None,DB_Appointment.date<freebusy.from_unix(last),
+        db.or_(DB_Appointment.repeat_until==None,DB_Appointment.repeat_until>freebusy.from_unix(first-MAX_DURATION)))
+    return db.or_(single,recurring)
+
+def busy_intervals(user_name,min_start,max_start):
+    """Function returns the sorted (start, end) timestamps of the appointments of the user that overlap with the datetimes min_start to max_start,
+    served from the busy cache where possible."""
+    return busy_cache.intervals(user_name,freebusy.to_unix(min_start),freebusy.to_unix(max_start),load_busy)
+
+def containing_calendars(column,calendar_ids,appointment_ids=()):
+    """Generator yields the SQL conditions selecting the calendar ids in column that are one of the calendars or contain one of the appointments.
+    Appointment ids are passed in chunks of 500 to stay below the bound variable limit of SQLite, one condition per chunk."""
+    calendar_ids,appointment_ids=list(calendar_ids),list(appointment_ids)
+    for i in range(0,max(len(appointment_ids),1),500):
+        condition=column.in_(calendar_ids)
+        if len(appointment_ids)>0:
+            containing=db.session.query(DB_CAA.calendar_id).filter(DB_CAA.appointment_id.in_(appointment_ids[i:i+500]))
+            condition=db.or_(condition,column.in_(containing))
+        yield condition
+
+def users_of(calendar_ids,appointment_ids=()):
+    """Function returns the names of all users that can see one of the calendars or a calendar that contains one of the appointments."""
+    user_names=set()
+    for calendars in containing_calendars(DB_UCA.calendar_id,calendar_ids,appointment_ids):
+        user_names.update(user_name for user_name, in db.session.query(DB_UCA.user_name).filter(calendars).distinct())
+    return user_names
+
+def touch_calendars(calendar_ids,appointment_ids=()):
+    """bumps the versions of the calendars and of the calendars that contain one of the appointments, which changes their ETags
+    and the ETags of their users. Called with the arguments of users_of by every write to appointments, before the commit."""
+    for calendars in containing_calendars(DB_Calendar.id,calendar_ids,appointment_ids):
+        db.session.query(DB_Calendar).filter(calendars).update({DB_Calendar.version:DB_Calendar.version+1},synchronize_session=False)
+
+def touch_users(user_names):
+    """bumps the versions of the users, called by every write that adds calendars to them."""
+    db.session.query(DB_User).filter(DB_User.name.in_(list(user_names))).update({DB_User.version:DB_User.version+1},synchronize_session=False)
+
+def log_change(kind,calendar_id,appointment=None,user_name=None):
+    """adds an entry to the change log of the calendar, committed with the transaction of the change. See models.Change for the kinds."""
+    db.session.add(DB_Change(kind=kind,calendar_id=calendar_id,user_name=user_name,
+        appointment_id=appointment.id if appointment is not None else None,
+        name=appointment.name if appointment is not None else None,
+        start_epoch=appointment.start_epoch if appointment is not None else None))
+
+def log_appointments(kind,appointment_ids):
+    """Function adds an entry to the change log of every calendar that contains one of the appointments, with one INSERT ... SELECT
+    per 500 appointments. Deletions have to be logged before the appointments are deleted."""
+    appointment_ids=list(appointment_ids)
+    if len(appointment_ids)==0:
+        return
+    #the statement reads the appointments and associations, pending changes to them are written first
+    db.session.flush()
+    for i in range(0,len(appointment_ids),500):
+        rows=db.session.query(db.literal(kind),DB_CAA.calendar_id,DB_Appointment.id,DB_Appointment.name,DB_Appointment.start_epoch)\
+            .join(DB_Appointment,DB_Appointment.id==DB_CAA.appointment_id)\
+            .filter(DB_CAA.appointment_id.in_(appointment_ids[i:i+500]))
+        db.session.execute(DB_Change.__table__.insert().from_select(["kind","calendar_id","appointment_id","name","start_epoch"],rows.statement))
+
+def log_upserts(results):
+    """logs the results of upsert_appointments, appointments inserted and updated by the same batch are logged as insertion."""
+    inserted={appointment.id for kind,appointment in results if kind=="insertion"}
+    log_appointments("insertion",inserted)
+    log_appointments("update",{appointment.id for kind,appointment in results if kind=="update"}-inserted)
+
+def lock_users(user_names):
+    """locks the rows of the users until the end of the transaction by bumping their versions. A write is the only lock all databases
+    share: MySQL locks the rows, SQLite takes its database wide write lock. On SQLite, this serializes all bookings, including those
+    of distinct users, so booking throughput does not grow with concurrency there. The rows are locked in the order of the names,
+    so transactions locking overlapping sets of users cannot deadlock."""
+    touch_users(sorted(user_names))
+
+def user_etag(user_name,readable=True):
+    """Function returns the ETag of the readable or epoch representation of the user, derived from the versions of the user
+    and of the user's calendars with a single query. Returns None if the user does not exist.
+    The query loads the user as well, which is kept for resolve_user."""
+    rows=db.session.query(DB_User,DB_Calendar.id,DB_Calendar.version)\
+        .outerjoin(DB_UCA,DB_UCA.user_name==DB_User.name)\
+        .outerjoin(DB_Calendar,DB_Calendar.id==DB_UCA.calendar_id)\
+        .filter(DB_User.name==user_name)\
+        .order_by(DB_Calendar.id).all()
+    g.setdefault("users",{})[user_name]=rows[0][0] if len(rows)>0 else None
+    if len(rows)==0:
+        return None
+    return make_etag(["user",user_name,readable]+[[user.version,calendar_id,version] for user,calendar_id,version in rows])
+
+def make_etag(versions):
+    """returns a quoted ETag for the JSON serializable list of versions."""
+    return '"'+hashlib.sha1(json.dumps(versions).encode()).hexdigest()[:20]+'"'
+
+def etag_matches(if_none_match,etag):
+    """checks whether the If-None-Match header value lists the ETag, using the weak comparison defined for If-None-Match."""
+    if if_none_match is None:
+        return False
+    tags=[tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
 
+def invalidate_busy(user_names):
+    """drops the cached busy intervals of the users. Called with the result of users_of after every committed write to appointments."""
+    for user_name in user_names:
+        busy_cache.invalidate(user_name)
 
 api.add_resource(Users,'/users','/')
 api.add_resource(User,'/user/<user_name>')
 api.add_resource(Appointment,'/appointments/<user_name>/<calendar_name>')
 api.add_resource(Search,'/search/<user_name>')
 api.add_resource(Availability,'/availability/<user_name>')
+api.add_resource(TeamAvailability,'/team/availability')
 api.add_resource(Booking,'/book/<user_name>/<calendar_name>')
 api.add_resource(Sharing,'/share/<user_name>/<calendar_name>')
+api.add_resource(BulkSharing,'/bulk/share/<user_name>/<calendar_name>')
+api.add_resource(BulkInvitation,'/bulk/invite/<user_name>/<calendar_name>')
+api.add_resource(Job,'/jobs/<job_id>')
+api.add_resource(Sync,'/sync/<user_name>')
+api.add_resource(Stats,'/stats')
 
 parser = reqparse.RequestParser()
 parser.add_argument('user',type=str)
@@ -448,6 +1261,21 @@ parser.add_argument('name',type=str)
 parser.add_argument('start',type=int)
 parser.add_argument('dur',type=int)
 parser.add_argument('days_ahead',type=int)
+parser.add_argument('repeat',type=str)
+parser.add_argument('count',type=int)
+parser.add_argument('until',type=int)
+parser.add_argument('except',type=int,action='append')
+parser.add_argument('limit',type=int)
+parser.add_argument('cursor',type=str)
+parser.add_argument('dates',type=str,choices=('readable','epoch'))
+parser.add_argument('since',type=str)
+
+#the availability of a meeting is requested for any number of participants, passed as repeated 'user' arguments
+availability_parser=parser.copy()
+availability_parser.replace_argument('user',type=str,action='append')
 
 if __name__=='__main__':
-    app.run(debug=True)
\ No newline at end of file
+    import migrations
+    with app.app_context():
+        migrations.upgrade(db.engine)
+    app.run(debug=app.config["DEBUG"])
\ No newline at end of file
@@ -0,0 +1,348 @@
+"""ASGI app serving the routes of api.py with async handlers, run with: uvicorn asgi:app
+
+Requests are validated with pydantic models instead of reqparse. The handlers await the operations of api.py in the
+thread pool, each call within its own Flask application context and therefore with its own scoped session on the
+pooled engine of api.app. A slow query only occupies its worker thread, while the event loop keeps accepting and
+answering other requests. The busy cache lives in the process, so the app is served by a single worker.
+The database is upgraded to the latest schema of migrations.py when the server starts, before it accepts requests."""
+import asyncio, datetime
+from typing import List, Literal, Optional
+from pydantic import BaseModel, ValidationError
+from pydantic.fields import SHAPE_SINGLETON
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import QueryParams
+from starlette.endpoints import HTTPEndpoint
+from starlette.middleware import Middleware
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+import api, ics, migrations
+from metrics import MetricsMiddleware
+
+#rows per query when a complete listing is streamed as newline delimited JSON
+STREAM_PAGE=500
+
+#request arguments whose names are not valid field names of the pydantic models
+ARGUMENT_NAMES={"exceptions":"except"}
+
+class DatesArgs(BaseModel):
+    dates:Optional[Literal["readable","epoch"]]=None
+
+class ListingArgs(DatesArgs):
+    limit:Optional[int]=None
+    cursor:Optional[str]=None
+
+class SyncArgs(DatesArgs):
+    since:Optional[str]=None
+    limit:Optional[int]=None
+
+class UserArgs(BaseModel):
+    user:Optional[str]=None
+
+class CalendarArgs(BaseModel):
+    calendar:Optional[str]=None
+
+class AppointmentArgs(BaseModel):
+    name:Optional[str]=None
+    start:Optional[int]=None
+    dur:Optional[int]=None
+    repeat:Optional[str]=None
+    count:Optional[int]=None
+    until:Optional[int]=None
+    exceptions:Optional[List[int]]=None
+
+class SearchArgs(DatesArgs):
+    name:Optional[str]=None
+    start:Optional[int]=None
+    days_ahead:Optional[int]=None
+
+class AvailabilityArgs(BaseModel):
+    user:Optional[List[str]]=None
+    days_ahead:Optional[int]=None
+
+class BookingArgs(BaseModel):
+    user:Optional[str]=None
+    name:Optional[str]=None
+    start:Optional[int]=None
+    dur:Optional[int]=None
+
+class BulkArgs(BaseModel):
+    user:Optional[List[str]]=None
+    name:Optional[str]=None
+    start:Optional[int]=None
+
+class Users(HTTPEndpoint):
+    async def get(self,request):
+        return await listing(request,api.list_users)
+
+    async def post(self,request):
+        args=await arguments(request,UserArgs)
+        return await call(api.create_user,args.user)
+
+class User(HTTPEndpoint):
+    async def get(self,request):
+        args=await arguments(request,DatesArgs)
+        return await call(api.show_user,request.path_params["user_name"],request.headers.get("if-none-match"),api.is_readable(args.dict()))
+
+    async def post(self,request):
+        args=await arguments(request,CalendarArgs)
+        return await call(api.create_calendar,request.path_params["user_name"],args.calendar)
+
+class Appointment(HTTPEndpoint):
+    async def get(self,request):
+        if wants_calendar(request):
+            return await calendar_export(request.path_params["user_name"],request.path_params["calendar_name"])
+        return await listing(request,api.list_calendar,request.path_params["user_name"],request.path_params["calendar_name"],conditional=True)
+
+    async def post(self,request):
+        path=request.path_params
+        #an iCalendar text is imported while it is uploaded
+        if request.headers.get("content-type","").startswith("text/calendar"):
+            return await call(api.import_calendar,path["user_name"],path["calendar_name"],body_chunks(request,asyncio.get_event_loop()))
+        #a JSON array of appointments is imported as a batch
+        batch=await json_body(request)
+        if isinstance(batch,list):
+            return await call(api.save_appointments,path["user_name"],path["calendar_name"],batch)
+        args=await arguments(request,AppointmentArgs)
+        return await call(api.save_appointment,path["user_name"],path["calendar_name"],args.name,args.start,args.dur,args.repeat,args.count,args.until,args.exceptions)
+
+    async def delete(self,request):
+        path=request.path_params
+        args=await arguments(request,AppointmentArgs)
+        return await call(api.delete_appointment,path["user_name"],path["calendar_name"],args.name,args.start)
+
+class Search(HTTPEndpoint):
+    async def get(self,request):
+        return await listing(request,api.list_user_appointments,request.path_params["user_name"])
+
+    async def post(self,request):
+        args=await arguments(request,SearchArgs)
+        return await call(api.search_appointments,request.path_params["user_name"],args.name,args.start,args.days_ahead,api.is_readable(args.dict()))
+
+class Availability(HTTPEndpoint):
+    async def post(self,request):
+        args=await arguments(request,AvailabilityArgs)
+        return await call(api.find_availability,request.path_params["user_name"],args.user,args.days_ahead)
+
+class TeamAvailability(HTTPEndpoint):
+    async def post(self,request):
+        args=await arguments(request,AvailabilityArgs)
+        return await call(api.find_team_availability,args.user,args.days_ahead)
+
+class Booking(HTTPEndpoint):
+    async def post(self,request):
+        path=request.path_params
+        args=await arguments(request,BookingArgs)
+        return await call(api.book_appointment,path["user_name"],path["calendar_name"],args.user,args.name,args.start,args.dur)
+
+class Sharing(HTTPEndpoint):
+    async def post(self,request):
+        args=await arguments(request,UserArgs)
+        return await call(api.share_calendar,request.path_params["user_name"],request.path_params["calendar_name"],args.user)
+
+class BulkSharing(HTTPEndpoint):
+    async def post(self,request):
+        args=await arguments(request,BulkArgs)
+        return await call(api.bulk_share_calendar,request.path_params["user_name"],request.path_params["calendar_name"],args.user)
+
+class BulkInvitation(HTTPEndpoint):
+    async def post(self,request):
+        path=request.path_params
+        args=await arguments(request,BulkArgs)
+        return await call(api.bulk_invite,path["user_name"],path["calendar_name"],args.user,args.name,args.start)
+
+class Job(HTTPEndpoint):
+    async def get(self,request):
+        body,status=api.show_job(request.path_params["job_id"])
+        return JSONResponse(body,status_code=status)
+
+class Sync(HTTPEndpoint):
+    async def get(self,request):
+        args=await arguments(request,SyncArgs)
+        return await call(api.sync_user,request.path_params["user_name"],args.since,args.limit,api.is_readable(args.dict()))
+
+class Stats(HTTPEndpoint):
+    async def get(self,request):
+        return JSONResponse({"busy_cache":api.busy_cache.stats(),"body_cache":api.body_cache.stats(),"jobs":api.jobs.stats()})
+
+class Metrics(HTTPEndpoint):
+    async def get(self,request):
+        return PlainTextResponse(api.metrics.render(),media_type="text/plain; version=0.0.4")
+
+class StreamedResponse(StreamingResponse):
+    """streams the body without listening for the disconnect of the client in parallel, which StreamingResponse of the pinned
+    Starlette does by passing coroutines to asyncio.wait, rejected since Python 3.11."""
+    async def __call__(self,scope,receive,send):
+        await self.stream_response(send)
+
+class InvalidArguments(Exception):
+    """raised when the arguments of a request do not pass the validation of their pydantic model."""
+    def __init__(self,error):
+        super().__init__(str(error))
+        #same shape as the errors of reqparse: {"message": {argument: error}}
+        self.message={ARGUMENT_NAMES.get(item["loc"][0],item["loc"][0]):item["msg"] for item in error.errors()}
+
+async def json_body(request):
+    """returns the decoded JSON body of the request or None if the request has no JSON body."""
+    if not request.headers.get("content-type","").startswith("application/json"):
+        return None
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+async def arguments(request,model):
+    """Function collects the fields of the pydantic model from the query string and the form or JSON body of the request,
+    like reqparse does for the Flask resources, and returns the validated model. Fields holding lists take every value of a repeated argument."""
+    sources=[request.query_params]
+    body=await json_body(request)
+    if isinstance(body,dict):
+        sources.append(body)
+    elif request.headers.get("content-type","").startswith("application/x-www-form-urlencoded"):
+        #parsed like a query string, request.form() would need python-multipart
+        sources.append(QueryParams((await request.body()).decode()))
+
+    values={}
+    for name,field in model.__fields__.items():
+        argument=ARGUMENT_NAMES.get(name,name)
+        for source in sources:
+            if isinstance(source,dict):
+                if argument in source:
+                    values[name]=source[argument]
+                continue
+            given=source.getlist(argument)
+            if len(given)>0:
+                values[name]=given[0] if field.shape==SHAPE_SINGLETON else values.get(name,[])+given
+    try:
+        return model(**values)
+    except ValidationError as error:
+        raise InvalidArguments(error)
+
+def body_chunks(request,loop):
+    """Generator yields the chunks of the request body to an operation running in the thread pool, receiving each of them on the event loop."""
+    stream=request.stream()
+    while True:
+        try:
+            yield asyncio.run_coroutine_threadsafe(stream.__anext__(),loop).result()
+        except StopAsyncIteration:
+            return
+
+def ndjson_lines(listing):
+    """renders a listing as list of NDJSON lines."""
+    return list(listing.lines())
+
+def calendar_events(listing):
+    """renders a listing of appointments as the text of their iCalendar events."""
+    stamp=ics.format_time(datetime.datetime.utcnow())
+    return "".join(ics.event(appointment,stamp) for appointment,_ in listing.rows)
+
+def run(operation,args,render=None):
+    """Function runs the operation of api.py within an application context and returns (body, status, headers).
+    Listings are serialized before the context ends, as JSON document or with the function render if passed."""
+    with api.app.app_context():
+        result=operation(*args)
+        if not isinstance(result,tuple):
+            result=(result,200)
+        if isinstance(result[0],api.Listing):
+            listing,status,headers=result
+            result=(render(listing) if render is not None else listing.document(),status,headers)
+    return result+({},)*(3-len(result))
+
+async def call(operation,*args):
+    """awaits the operation of api.py in the thread pool and returns its result as JSON response."""
+    body,status,headers=await run_in_threadpool(run,operation,args)
+    if status==304:
+        return Response(status_code=status,headers=headers)
+    return JSONResponse(body,status_code=status,headers=headers)
+
+async def listing(request,operation,*args,conditional=False):
+    """Function serves a listing operation of api.py. Clients that accept 'application/x-ndjson' get one JSON document per line,
+    complete listings are then streamed in keyset pages of STREAM_PAGE rows with one thread pool call per page.
+    Operations that are conditional take the If-None-Match header for their JSON documents."""
+    query=await arguments(request,ListingArgs)
+    readable=api.is_readable(query.dict())
+    if not wants_ndjson(request):
+        if conditional:
+            return await call(operation,*args,query.limit,query.cursor,False,readable,request.headers.get("if-none-match"))
+        return await call(operation,*args,query.limit,query.cursor,False,readable)
+
+    limit=query.limit if query.limit is not None else STREAM_PAGE
+    lines,status,headers=await run_in_threadpool(run,operation,args+(limit,query.cursor,True,readable),ndjson_lines)
+    if status!=200:
+        return JSONResponse(lines,status_code=status,headers=headers)
+    if query.limit is not None:
+        return StreamedResponse(iter(lines),media_type="application/x-ndjson",headers=headers)
+
+    async def pages(lines,cursor):
+        while True:
+            for line in lines:
+                yield line
+            if cursor is None:
+                return
+            lines,_,headers=await run_in_threadpool(run,operation,args+(STREAM_PAGE,cursor,True,readable),ndjson_lines)
+            cursor=headers.get("X-Next-Cursor")
+    return StreamedResponse(pages(lines,headers.get("X-Next-Cursor")),media_type="application/x-ndjson")
+
+async def calendar_export(user_name,calendar_name):
+    """Function streams the appointments of the calendar as iCalendar text, read in keyset pages of STREAM_PAGE rows with one thread pool call per page."""
+    events,status,headers=await run_in_threadpool(run,api.list_calendar,(user_name,calendar_name,STREAM_PAGE,None,True),calendar_events)
+    if status!=200:
+        return JSONResponse(events,status_code=status,headers=headers)
+
+    async def chunks(events,cursor):
+        yield ics.header(calendar_name)
+        while True:
+            yield events
+            if cursor is None:
+                break
+            events,_,headers=await run_in_threadpool(run,api.list_calendar,(user_name,calendar_name,STREAM_PAGE,cursor,True),calendar_events)
+            cursor=headers.get("X-Next-Cursor")
+        yield ics.FOOTER
+    return StreamedResponse(chunks(events,headers.get("X-Next-Cursor")),media_type="text/calendar")
+
+def wants_calendar(request):
+    """checks whether the client prefers an iCalendar text over JSON, like api.wants_calendar."""
+    accept=parse_accept_header(request.headers.get("accept"),MIMEAccept)
+    return accept.best_match(["application/json","text/calendar"])=="text/calendar"
+
+def wants_ndjson(request):
+    """checks whether the client prefers newline delimited JSON over a single JSON document, like api.wants_ndjson."""
+    accept=parse_accept_header(request.headers.get("accept"),MIMEAccept)
+    return accept.best_match(["application/json","application/x-ndjson"])=="application/x-ndjson"
+
+async def invalid_arguments(request,error):
+    """answers requests with invalid arguments with status 400."""
+    return JSONResponse({"message":error.message},status_code=400)
+
+routes=[
+    Route('/users',Users),
+    Route('/',Users),
+    Route('/user/{user_name}',User),
+    Route('/appointments/{user_name}/{calendar_name}',Appointment),
+    Route('/search/{user_name}',Search),
+    Route('/availability/{user_name}',Availability),
+    Route('/team/availability',TeamAvailability),
+    Route('/book/{user_name}/{calendar_name}',Booking),
+    Route('/share/{user_name}/{calendar_name}',Sharing),
+    Route('/bulk/share/{user_name}/{calendar_name}',BulkSharing),
+    Route('/bulk/invite/{user_name}/{calendar_name}',BulkInvitation),
+    Route('/jobs/{job_id}',Job),
+    Route('/sync/{user_name}',Sync),
+    Route('/stats',Stats),
+]
+
+#requests are timed and their SQL counted like those of the Flask app, see metrics.py
+middleware=[]
+if api.app.config["METRICS_ENABLED"]:
+    routes.append(Route('/metrics',Metrics))
+    middleware.append(Middleware(MetricsMiddleware,metrics=api.metrics))
+
+def upgrade_schema():
+    """applies the pending migrations to the database on startup, like running api.py does."""
+    with api.app.app_context():
+        migrations.upgrade(api.db.engine)
+
+app=Starlette(debug=api.app.config["DEBUG"],routes=routes,middleware=middleware,exception_handlers={InvalidArguments:invalid_arguments},
+    on_startup=[upgrade_schema])
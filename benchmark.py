@@ -0,0 +1,453 @@
+"""Load benchmark of the calendar API.
+
+Builds a synthetic data set in a temporary SQLite database from a seed, drives every resource of api.py through the
+Flask test client and reports latency percentiles, throughput, queries per request and peak RSS as JSON.
+Runs with the same arguments produce the same data and requests, so their reports can be compared:
+
+    python benchmark.py --output baseline.json
+    python benchmark.py --baseline baseline.json
+
+exits with status 1 if a scenario got slower or issues more queries than in the baseline.
+Besides the JSON resources, the scenarios cover the iCalendar import and export, delta syncs and the bulk endpoints with the
+jobs they queue. Every scenario waits for the jobs of the previous ones to finish, and the statements of jobs are not counted
+as queries of the request that queued them.
+With --server, the requests are sent over HTTP by --concurrency client threads to the threaded Flask server of api.py
+or to asgi.py served by uvicorn, both on the same generated database:
+
+    python benchmark.py --server flask --concurrency 16
+    python benchmark.py --server asgi --concurrency 16
+
+--profile selects the configuration profile of config.py, e.g. to compare the default SQLite setup with the tuned
+production one under concurrent writes:
+
+    python benchmark.py --server asgi --concurrency 16 --profile production
+
+--stress books concurrently instead: first --requests bookings among a few users at random overlapping slots, then
+--requests bookings per thread for distinct pairs of users with 1, 2, 4 ... --concurrency threads. It reports the
+booking throughput per thread count and exits with status 1 if a user ended up with overlapping appointments:
+
+    python benchmark.py --stress --server asgi --concurrency 8 --profile production
+
+On SQLite the throughput stays flat across thread counts, about 50 bookings per second from 1 to 8 threads: a booking locks
+its users with a write, which takes SQLite's database wide write lock, so all bookings are serialized, even those of distinct
+users. Bookings of distinct users only run in parallel on MySQL, which locks single rows, and that has not been measured.
+test_booking.py checks the absence of double bookings under contention."""
+import argparse, datetime, json, math, os, random, resource, secrets, socket, subprocess, sys, tempfile, threading, time
+import urllib.error, urllib.parse, urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import event
+
+def percentile(values,fraction):
+    """returns the value below which the fraction of the sorted values lies (nearest rank)."""
+    index=max(0,math.ceil(fraction*len(values))-1)
+    return values[index]
+
+#monday the generated appointments start on, in UTC like all naive datetimes. A fixed day makes runs on different days
+#generate the same data and requests. The availability scenarios look ahead from now and see none of the appointments.
+FIRST_DAY=datetime.datetime(2030,1,7)
+
+def random_slot(first_day,args,rng):
+    """returns a random start at a quarter hour within working hours on a weekday of the benchmark period."""
+    day=rng.randrange(args.days)
+    #move weekend days to the friday before
+    day-=max(0,day%7-4)
+    return first_day+datetime.timedelta(days=day,minutes=9*60+15*rng.randrange(32))
+
+def generate(db,models,args,rng):
+    """Function fills the database with args.users users, args.calendars calendars per user, args.shares shared calendars per user
+    and args.appointments appointments per calendar, spread over args.days days from FIRST_DAY on.
+    Rows are written with bulk inserts. Returns the data set description used to build requests."""
+    first_day=FIRST_DAY
+    users=[f"user{i}" for i in range(args.users)]
+    db.session.bulk_insert_mappings(models.User,[{"name":name,"secret":secrets.token_hex(nbytes=4)} for name in users])
+
+    calendars,uc_rows=[],[]
+    for name in users:
+        for c in range(args.calendars):
+            calendars.append({"id":len(calendars)+1,"name":f"calendar{c}","owned_by":name})
+            uc_rows.append({"user_name":name,"calendar_id":len(calendars),"status":"default" if c==0 else "own"})
+    db.session.bulk_insert_mappings(models.Calendar,calendars)
+    shared=set()
+    for name in users:
+        for _ in range(args.shares):
+            calendar=rng.choice(calendars)
+            if calendar["owned_by"]!=name and (name,calendar["id"]) not in shared:
+                shared.add((name,calendar["id"]))
+                uc_rows.append({"user_name":name,"calendar_id":calendar["id"],"status":"pending"})
+    db.session.bulk_insert_mappings(models.UC_Association,uc_rows)
+
+    appointments,ca_rows=[],[]
+    for calendar in calendars:
+        for k in range(args.appointments):
+            start=random_slot(first_day,args,rng)
+            name=f"{rng.choice(WORDS)} {rng.choice(WORDS)} {k}"
+            duration=rng.choice((15,30,45,60))
+            appointments.append({"id":len(appointments)+1,"name":name,"date":start,"duration":duration,
+                "start_epoch":models.epoch(start),"end_epoch":models.epoch(start)+duration*60,"origin_id":calendar["id"]})
+            ca_rows.append({"calendar_id":calendar["id"],"appointment_id":len(appointments),"status":"host"})
+    db.session.bulk_insert_mappings(models.Appointment,appointments)
+    db.session.bulk_insert_mappings(models.CA_Association,ca_rows)
+    db.session.commit()
+    return {"users":users,"calendars":calendars,"appointments":appointments,"shared":shared,"first_day":first_day}
+
+WORDS=("team","standup","review","planning","party","lunch","sync","retro","design","budget","demo","client","interview","launch")
+
+def scenarios(data,args,rng,send):
+    """Function returns the list of (name, method, request factory) driven by the benchmark. Every factory returns the
+    (url, form data) or (url, body, headers) of the next request. Read scenarios come first, so that they see the generated data set.
+    send(method, url, form) is used for the requests that factories need the answer of, e.g. the job whose status is requested."""
+    users,calendars,appointments=data["users"],data["calendars"],data["appointments"]
+    #naive datetimes are UTC, like in the database
+    timestamp=lambda dt:int(dt.replace(tzinfo=datetime.timezone.utc).timestamp())
+    counter={"user":0,"appointment":0,"import":0}
+    #token of the empty change log, the syncs return every change made by the write scenarios
+    token=urllib.parse.quote(json.loads(send("get",f"/sync/{users[0]}",None)[1])["token"])
+
+    def new_user():
+        counter["user"]+=1
+        return "/users",{"user":f"new_user{counter['user']}"}
+
+    def new_calendar():
+        counter["user"]+=1
+        return f"/user/{rng.choice(users)}",{"calendar":f"new_calendar{counter['user']}"}
+
+    def new_appointment():
+        calendar=rng.choice(calendars)
+        counter["appointment"]+=1
+        start=random_slot(data["first_day"],args,rng)
+        return f"/appointments/{calendar['owned_by']}/{calendar['name']}",{"name":f"new {counter['appointment']}","start":timestamp(start),"dur":30}
+
+    def update_appointment():
+        appointment=rng.choice(appointments)
+        calendar=calendars[appointment["origin_id"]-1]
+        return f"/appointments/{calendar['owned_by']}/{calendar['name']}",{"name":appointment["name"],"start":timestamp(appointment["date"]),"dur":45}
+
+    def delete_appointment():
+        #deleted appointments are removed from the pool, so every request deletes an existing one
+        appointment=appointments.pop(rng.randrange(len(appointments)))
+        calendar=calendars[appointment["origin_id"]-1]
+        return f"/appointments/{calendar['owned_by']}/{calendar['name']}",{"name":appointment["name"],"start":timestamp(appointment["date"])}
+
+    def booking():
+        host,guest=rng.sample(users,2)
+        start=random_slot(data["first_day"],args,rng)
+        return f"/book/{host}/calendar0",{"user":guest,"name":"booked","start":timestamp(start),"dur":30}
+
+    def sharing():
+        while True:
+            calendar,user=rng.choice(calendars),rng.choice(users)
+            if calendar["owned_by"]!=user and (user,calendar["id"]) not in data["shared"]:
+                data["shared"].add((user,calendar["id"]))
+                return f"/share/{calendar['owned_by']}/{calendar['name']}",{"user":user}
+
+    def ics_import():
+        #new names, so that every request imports new appointments
+        calendar=rng.choice(calendars)
+        counter["import"]+=1
+        lines=["BEGIN:VCALENDAR","VERSION:2.0"]
+        for k in range(20):
+            start=random_slot(data["first_day"],args,rng)
+            lines+=["BEGIN:VEVENT",f"SUMMARY:imported {counter['import']} {k}",f"DTSTART:{start:%Y%m%dT%H%M%SZ}","DURATION:PT30M","END:VEVENT"]
+        body=("\r\n".join(lines+["END:VCALENDAR"])+"\r\n").encode()
+        return f"/appointments/{calendar['owned_by']}/{calendar['name']}",body,{"Content-Type":"text/calendar"}
+
+    def bulk_sharing():
+        calendar=rng.choice(calendars)
+        return f"/bulk/share/{calendar['owned_by']}/{calendar['name']}",{"user":rng.sample(users,min(20,len(users)))}
+
+    def bulk_invitation():
+        appointment=rng.choice(appointments)
+        calendar=calendars[appointment["origin_id"]-1]
+        return f"/bulk/invite/{calendar['owned_by']}/{calendar['name']}",{"user":rng.sample(users,min(20,len(users))),
+            "name":appointment["name"],"start":timestamp(appointment["date"])}
+
+    def job():
+        #queues a bulk share, whose status is then requested
+        url,form=bulk_sharing()
+        return f"/jobs/{json.loads(send('post',url,form)[1])['job']['id']}",None
+
+    return [
+        ("users_get","get",lambda:("/users",None)),
+        ("users_get_page","get",lambda:("/users?limit=20",None)),
+        ("user_get","get",lambda:(f"/user/{rng.choice(users)}",None)),
+        ("appointments_get","get",lambda:(lambda calendar:(f"/appointments/{calendar['owned_by']}/{calendar['name']}",None))(rng.choice(calendars))),
+        ("search_get","get",lambda:(f"/search/{rng.choice(users)}",None)),
+        ("search_post","post",lambda:(f"/search/{rng.choice(users)}",{"name":rng.choice(WORDS)[:4]})),
+        ("availability_post","post",lambda:(lambda team:(f"/availability/{team[0]}",{"user":team[1:],"days_ahead":args.days}))(rng.sample(users,min(3,len(users))))),
+        ("team_availability_post","post",lambda:("/team/availability",{"user":rng.sample(users,min(50,len(users))),"days_ahead":args.days})),
+        ("appointments_get_ics","get",lambda:(lambda calendar:(f"/appointments/{calendar['owned_by']}/{calendar['name']}",None,{"Accept":"text/calendar"}))(rng.choice(calendars))),
+        ("stats_get","get",lambda:("/stats",None)),
+        ("users_post","post",new_user),
+        ("user_post","post",new_calendar),
+        ("appointment_post_insert","post",new_appointment),
+        ("appointment_post_update","post",update_appointment),
+        ("appointment_delete","delete",delete_appointment),
+        ("booking_post","post",booking),
+        ("sharing_post","post",sharing),
+        ("ics_post","post",ics_import),
+        ("bulk_sharing_post","post",bulk_sharing),
+        ("bulk_invitation_post","post",bulk_invitation),
+        ("job_get","get",job),
+        ("sync_get","get",lambda:(f"/sync/{rng.choice(users)}?since={token}",None)),
+    ]
+
+def serve(server):
+    """Function starts the threaded Flask server of api.py or asgi.py in uvicorn on the database configured in the environment.
+    Returns the server process and its base URL once it answers requests."""
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1",0))
+        port=probe.getsockname()[1]
+    if server=="flask":
+        command=[sys.executable,"-c",f"import api; api.app.run(port={port},debug=False,threaded=True)"]
+    else:
+        command=[sys.executable,"-m","uvicorn","asgi:app","--port",str(port),"--log-level","warning"]
+    process=subprocess.Popen(command,cwd=os.path.dirname(os.path.abspath(__file__)),stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL)
+    base=f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(base+"/stats").close()
+            return process,base
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"The {server} server did not start")
+
+def send_http(base,method,url,form,headers=None):
+    """sends a request with the form data or body to the server and returns the status code and the body of the response."""
+    data=urllib.parse.urlencode(form,doseq=True).encode() if isinstance(form,dict) else form
+    try:
+        with urllib.request.urlopen(urllib.request.Request(base+url,data=data,headers=headers or {},method=method.upper())) as response:
+            return response.status,response.read()
+    except urllib.error.HTTPError as error:
+        return error.code,error.read()
+
+def pending_jobs(api,base):
+    """returns the number of queued and running jobs of the API, served by this process or at base."""
+    if base is None:
+        stats=api.jobs.stats()
+    else:
+        with urllib.request.urlopen(base+"/stats") as response:
+            stats=json.load(response)["jobs"]
+    return stats["queued"]+stats["running"]
+
+def settle(api,base):
+    """waits until the jobs queued by earlier requests are finished."""
+    while pending_jobs(api,base)>0:
+        time.sleep(0.01)
+
+def prepare(args,rng):
+    """Function generates the data set in a new temporary database and starts the server selected by args.server.
+    Returns the api module, the data set, the list holding the count of executed statements, send(method, url, form, headers)
+    returning the status code and body of a request, and the server process and base URL."""
+    path=os.path.join(tempfile.mkdtemp(),"benchmark.db")
+
+    #the profile is read when api is imported, the server processes inherit it
+    os.environ["CALENDAR_CONFIG"]=args.profile
+    os.environ["DATABASE_URL"]="sqlite:///"+path
+    import api, migrations, models
+    client=api.app.test_client()
+    queries=[0]
+    with api.app.app_context():
+        migrations.upgrade(models.db.engine)
+        #the worker threads of jobs.py run the bulk operations after their request has been answered
+        def count(*_):
+            if not threading.current_thread().name.startswith("job"):
+                queries[0]+=1
+        event.listen(models.db.engine,"before_cursor_execute",count)
+        data=generate(models.db,models,args,rng)
+        if args.stress:
+            data["stress"]=add_stress_users(models.db,models,data,args)
+
+    process,base=None,None
+    if args.server:
+        process,base=serve(args.server)
+        send=lambda method,url,form,headers=None:send_http(base,method,url,form,headers)
+    else:
+        def send(method,url,form,headers=None):
+            response=client.open(url,method=method.upper(),data=form,headers=headers)
+            body=response.get_data()
+            response.close()
+            return response.status_code,body
+    return api,data,queries,send,process,base
+
+def run(args):
+    """Function runs the benchmark and returns the report."""
+    rng=random.Random(args.seed)
+    api,data,queries,send,process,base=prepare(args,rng)
+
+    def timed(method,url,form,headers=None):
+        #statements are only counted in this process, that is without --server
+        queries[0]=0
+        before=time.perf_counter()
+        status,_=send(method,url,form,headers)
+        return time.perf_counter()-before,status,queries[0]
+
+    report={"parameters":vars(args).copy(),"scenarios":{}}
+    report["parameters"].pop("baseline",None)
+    report["parameters"].pop("output",None)
+    for name,method,build in scenarios(data,args,rng,send):
+        if args.only and name not in args.only:
+            continue
+        #requests are built before they are sent, so the concurrency does not change them
+        requests=[build() for _ in range(args.requests)]
+        settle(api,base)
+        started=time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            results=list(pool.map(lambda request:timed(method,*request),requests))
+        elapsed=time.perf_counter()-started
+        settle(api,base)
+        latencies=sorted(latency for latency,_,_ in results)
+        statuses={}
+        for _,status,_ in results:
+            statuses[str(status)]=statuses.get(str(status),0)+1
+        report["scenarios"][name]={
+            "requests":args.requests,
+            "statuses":statuses,
+            "throughput":args.requests/elapsed,
+            "p50_ms":percentile(latencies,0.5)*1000,
+            "p95_ms":percentile(latencies,0.95)*1000,
+            "p99_ms":percentile(latencies,0.99)*1000,
+            "queries_per_request":None if args.server else sum(count for _,_,count in results)/len(results)
+        }
+    if args.server:
+        with urllib.request.urlopen(base+"/stats") as response:
+            report["busy_cache"]=json.load(response)["busy_cache"]
+        process.terminate()
+        process.wait()
+    else:
+        report["busy_cache"]=api.busy_cache.stats()
+    #ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    report["peak_rss_mb"]=rss/1024/1024 if sys.platform=="darwin" else rss/1024
+    return report
+
+def add_stress_users(db,models,data,args):
+    """Function adds the users of the stress run, each with an empty default calendar: 4 contended users and a pair of
+    users per thread. Returns their names."""
+    contended=[f"contended{i}" for i in range(4)]
+    pairs=[(f"host{i}",f"guest{i}") for i in range(args.concurrency)]
+    names=contended+[name for pair in pairs for name in pair]
+    db.session.bulk_insert_mappings(models.User,[{"name":name,"secret":secrets.token_hex(nbytes=4)} for name in names])
+    first_id=len(data["calendars"])+1
+    db.session.bulk_insert_mappings(models.Calendar,[{"id":first_id+i,"name":"calendar0","owned_by":name} for i,name in enumerate(names)])
+    db.session.bulk_insert_mappings(models.UC_Association,[{"user_name":name,"calendar_id":first_id+i,"status":"default"} for i,name in enumerate(names)])
+    db.session.commit()
+    return {"contended":contended,"pairs":pairs}
+
+def overlapping(api,names):
+    """Function returns the number of pairs of appointments that overlap in the calendars of the users."""
+    overlaps=0
+    with api.app.app_context():
+        for name in names:
+            last_end=None
+            for start,end in api.load_busy(name,0,2**31):
+                if last_end is not None and start<last_end:
+                    overlaps+=1
+                last_end=end if last_end is None else max(last_end,end)
+    return overlaps
+
+def stress(args):
+    """Function runs the concurrent booking stress test and returns the report."""
+    rng=random.Random(args.seed)
+    api,data,_,send,process,base=prepare(args,rng)
+    #naive datetimes are UTC, like in the database
+    timestamp=lambda dt:int(dt.replace(tzinfo=datetime.timezone.utc).timestamp())
+    #the bookings start on the monday after the generated appointments
+    first_week=data["first_day"]+datetime.timedelta(days=7*(args.days//7+1))
+    book=lambda host,guest,start:send("post",f"/book/{host}/calendar0",{"user":guest,"name":"stress","start":timestamp(start),"dur":30})[0]
+
+    #every request competes with the others for the same users on the same day
+    contended=data["stress"]["contended"]
+    requests=[(*rng.sample(contended,2),first_week+datetime.timedelta(minutes=9*60+15*rng.randrange(32))) for _ in range(args.requests)]
+    started=time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        statuses=list(pool.map(lambda request:book(*request),requests))
+    report={"parameters":vars(args).copy(),"contention":{
+        "requests":args.requests,
+        "booked":statuses.count(200),
+        "rejected":statuses.count(400),
+        "throughput":args.requests/(time.perf_counter()-started)
+    },"scaling":{}}
+    report["parameters"].pop("baseline",None)
+    report["parameters"].pop("output",None)
+
+    #every thread books free hourly slots for its own pair of users, in weeks no earlier thread count used
+    pairs,week=data["stress"]["pairs"],1
+    threads=1
+    while True:
+        slots=[first_week+datetime.timedelta(weeks=week+k//45,days=k%45//9,hours=9+k%9) for k in range(args.requests)]
+        week+=args.requests//45+1
+        started=time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            statuses=list(pool.map(lambda pair:[book(*pair,slot) for slot in slots],pairs[:threads]))
+        elapsed=time.perf_counter()-started
+        report["scaling"][str(threads)]={
+            "booked":sum(status.count(200) for status in statuses),
+            "throughput":threads*args.requests/elapsed
+        }
+        if threads==args.concurrency:
+            break
+        threads=min(threads*2,args.concurrency)
+
+    report["double_bookings"]=overlapping(api,contended+[name for pair in pairs for name in pair])
+    if process is not None:
+        process.terminate()
+        process.wait()
+    return report
+
+def compare(report,baseline,threshold):
+    """Function returns the regressions of report against baseline: scenarios whose p95 latency grew by more than threshold
+    (a fraction) or that issue more queries per request."""
+    regressions=[]
+    for name,current in report["scenarios"].items():
+        previous=baseline["scenarios"].get(name)
+        if previous is None:
+            continue
+        if current["p95_ms"]>previous["p95_ms"]*(1+threshold):
+            regressions.append(f"{name}: p95 {previous['p95_ms']:.2f} ms -> {current['p95_ms']:.2f} ms")
+        if None not in (current["queries_per_request"],previous["queries_per_request"]) and current["queries_per_request"]>previous["queries_per_request"]:
+            regressions.append(f"{name}: queries per request {previous['queries_per_request']:.2f} -> {current['queries_per_request']:.2f}")
+    return regressions
+
+def main():
+    parser=argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users",type=int,default=50,help="number of users")
+    parser.add_argument("--calendars",type=int,default=2,help="calendars per user")
+    parser.add_argument("--shares",type=int,default=2,help="calendars shared with each user")
+    parser.add_argument("--appointments",type=int,default=100,help="appointments per calendar")
+    parser.add_argument("--days",type=int,default=30,help="days the appointments are spread over")
+    parser.add_argument("--requests",type=int,default=100,help="requests per scenario")
+    parser.add_argument("--seed",type=int,default=0,help="seed of the data and request generator")
+    parser.add_argument("--only",nargs="*",help="names of the scenarios to run, all by default")
+    parser.add_argument("--output",help="file the JSON report is written to, stdout by default")
+    parser.add_argument("--baseline",help="JSON report of an earlier run to compare against")
+    parser.add_argument("--threshold",type=float,default=0.2,help="tolerated growth of p95 latency against the baseline")
+    parser.add_argument("--server",choices=("flask","asgi"),help="send the requests over HTTP to the Flask or the ASGI server")
+    parser.add_argument("--concurrency",type=int,default=1,help="client threads sending requests at the same time, requires --server")
+    parser.add_argument("--profile",choices=("development","production"),default="development",help="configuration profile of the API")
+    parser.add_argument("--stress",action="store_true",help="run the concurrent booking stress test instead of the scenarios")
+    args=parser.parse_args()
+    if args.concurrency>1 and not args.server:
+        parser.error("--concurrency requires --server")
+
+    report=stress(args) if args.stress else run(args)
+    if args.output:
+        with open(args.output,"w") as output:
+            json.dump(report,output,indent=2)
+    else:
+        print(json.dumps(report,indent=2))
+
+    if args.stress and report["double_bookings"]>0:
+        print(f"DOUBLE BOOKINGS {report['double_bookings']}",file=sys.stderr)
+        sys.exit(1)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions=compare(report,json.load(baseline),args.threshold)
+        for regression in regressions:
+            print("REGRESSION "+regression,file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,47 @@
+"""In-process cache of serialized response bodies.
+
+Bodies are keyed by the ETag of the resource, which is derived from the version counters of the user and calendar rows.
+Every write bumps the versions of what it changed, so a changed resource gets a new key and outdated bodies are never
+served, they just age out of the LRU. As the versions live in the database, the cache needs no invalidation and
+stays correct with several worker processes."""
+import collections, threading
+
+class BodyCache(object):
+    """LRU cache of serialized bodies keyed by (resource, ETag), bounded to max_entries. A size of 0 disables the cache."""
+
+    def __init__(self,max_entries=1000):
+        self.max_entries=max_entries
+        self.bodies=collections.OrderedDict()
+        self.lock=threading.Lock()
+        self.hits=0
+        self.misses=0
+
+    def body(self,key,serialize):
+        """Function returns the cached body for the key or caches and returns the result of serialize()."""
+        if self.max_entries==0:
+            return serialize()
+        with self.lock:
+            body=self.bodies.get(key)
+            if body is not None:
+                self.hits+=1
+                self.bodies.move_to_end(key)
+                return body
+            self.misses+=1
+        body=serialize()
+        with self.lock:
+            self.bodies[key]=body
+            while len(self.bodies)>self.max_entries:
+                self.bodies.popitem(last=False)
+        return body
+
+    def stats(self):
+        """returns the hit and miss counters and the number of cached bodies."""
+        with self.lock:
+            lookups=self.hits+self.misses
+            return {
+                "hits":self.hits,
+                "misses":self.misses,
+                "hit_rate":self.hits/lookups if lookups>0 else 0.0,
+                "entries":len(self.bodies),
+                "max_entries":self.max_entries
+            }
@@ -0,0 +1,96 @@
+"""In-process cache of the busy intervals of users.
+
+The intervals of a user are cached in buckets of one week, so availability and booking checks only hit the database
+for weeks that have not been requested since the user's calendars last changed. Every write path has to call
+invalidate for all users that can see the changed calendars. The cache lives in the memory of one process,
+deployments with several worker processes keep one cache per process."""
+import collections, threading
+
+WEEK=7*24*60*60
+
+class BusyCache(object):
+    """LRU cache of sorted (start, end) busy intervals keyed by user and week, bounded to max_buckets entries.
+    An interval is kept in the bucket of every week it overlaps."""
+
+    def __init__(self,max_buckets=10000):
+        self.max_buckets=max_buckets
+        self.buckets=collections.OrderedDict()
+        self.weeks=collections.defaultdict(set)
+        self.generations=collections.defaultdict(int)
+        self.epoch=0
+        self.lock=threading.Lock()
+        self.hits=0
+        self.misses=0
+
+    def intervals(self,user_name,start,end,load):
+        """Function returns the sorted busy intervals of the user that overlap with the timestamps start to end.
+        Weeks that are not cached are fetched with a single call of load(user_name, first, last), which has to return the sorted
+        (start, end) intervals of all appointments of the user that overlap with the timestamps first (inclusive) to last (exclusive)."""
+        weeks=range(int(start//WEEK),int(end//WEEK)+1)
+        cached={}
+        with self.lock:
+            for week in weeks:
+                bucket=self.buckets.get((user_name,week))
+                if bucket is None:
+                    self.misses+=1
+                    continue
+                self.hits+=1
+                self.buckets.move_to_end((user_name,week))
+                cached[week]=bucket
+            generation=(self.epoch,self.generations[user_name])
+
+        missing=[week for week in weeks if week not in cached]
+        if len(missing)>0:
+            loaded={week:[] for week in range(missing[0],missing[-1]+1)}
+            for interval in load(user_name,missing[0]*WEEK,(missing[-1]+1)*WEEK):
+                first_week=int(interval[0]//WEEK)
+                last_week=max(first_week,int((interval[1]-1)//WEEK))
+                for week in range(max(first_week,missing[0]),min(last_week,missing[-1])+1):
+                    loaded[week].append(interval)
+            with self.lock:
+                #a write that happened while loading invalidated the user, the loaded data may already be outdated
+                if (self.epoch,self.generations[user_name])==generation:
+                    for week in missing:
+                        self.store(user_name,week,loaded[week])
+            for week in missing:
+                cached[week]=loaded[week]
+
+        #intervals spanning several weeks are found in each of their buckets
+        return sorted({interval for week in weeks for interval in cached[week] if interval[1]>start and interval[0]<end})
+
+    def store(self,user_name,week,bucket):
+        """adds a bucket and evicts the least recently used buckets beyond max_buckets. The caller holds the lock."""
+        self.buckets[(user_name,week)]=bucket
+        self.buckets.move_to_end((user_name,week))
+        self.weeks[user_name].add(week)
+        while len(self.buckets)>self.max_buckets:
+            (evicted_user,evicted_week),_=self.buckets.popitem(last=False)
+            self.weeks[evicted_user].discard(evicted_week)
+            if len(self.weeks[evicted_user])==0:
+                del self.weeks[evicted_user]
+
+    def invalidate(self,user_name):
+        """drops all cached intervals of the user."""
+        with self.lock:
+            self.generations[user_name]+=1
+            for week in self.weeks.pop(user_name,()):
+                del self.buckets[(user_name,week)]
+
+    def clear(self):
+        """drops all cached intervals."""
+        with self.lock:
+            self.epoch+=1
+            self.buckets.clear()
+            self.weeks.clear()
+
+    def stats(self):
+        """returns the hit and miss counters and the number of cached buckets."""
+        with self.lock:
+            lookups=self.hits+self.misses
+            return {
+                "hits":self.hits,
+                "misses":self.misses,
+                "hit_rate":self.hits/lookups if lookups>0 else 0.0,
+                "buckets":len(self.buckets),
+                "max_buckets":self.max_buckets
+            }
@@ -0,0 +1,41 @@
+"""Fixtures of the tests, which run the API of api.py with the Flask test client on a new SQLite database per test."""
+import pytest
+from sqlalchemy import event
+import api, migrations
+from busycache import BusyCache
+from bodycache import BodyCache
+from models import db
+
+@pytest.fixture
+def app(tmp_path,monkeypatch):
+    """the Flask app on an empty database upgraded by the migrations, with empty caches."""
+    monkeypatch.setitem(api.app.config,"SQLALCHEMY_DATABASE_URI",f"sqlite:///{tmp_path}/calendar.db")
+    monkeypatch.setattr(api,"busy_cache",BusyCache(api.app.config["BUSY_CACHE_SIZE"]))
+    monkeypatch.setattr(api,"body_cache",BodyCache(api.app.config["BODY_CACHE_SIZE"]))
+    with api.app.app_context():
+        migrations.upgrade(db.engine)
+    yield api.app
+    with api.app.app_context():
+        db.engine.dispose()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def statements(app):
+    """list of the (statement, parameters) run on the database while the test runs."""
+    executed=[]
+    def record(conn,cursor,statement,parameters,context,executemany):
+        executed.append((statement,parameters))
+    with app.app_context():
+        engine=db.engine
+    event.listen(engine,"before_cursor_execute",record)
+    yield executed
+    event.remove(engine,"before_cursor_execute",record)
+
+def add_user(client,name,calendars=("main",)):
+    """creates a user with the calendars, the first of which becomes the user's default calendar."""
+    assert client.post("/users",data={"user":name}).status_code==200
+    for calendar in calendars:
+        assert client.post(f"/user/{name}",data={"calendar":calendar}).status_code==200
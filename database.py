@@ -0,0 +1,33 @@
+"""Connection setup of the calendar database.
+
+SQLite keeps most of its tuning per connection, so the PRAGMA statements of Config.SQLITE_PRAGMAS are run on every
+connection the pool opens. Connections to other databases are left as they are.
+Flask-SQLAlchemy records every statement of an app context for get_debug_queries in debug mode, whatever
+SQLALCHEMY_RECORD_QUERIES says, so requests and jobs working in batches drop the recorded statements after every batch
+with forget_recorded_queries. Their memory then does not grow with their size."""
+import sqlite3
+from flask_sqlalchemy import get_debug_queries
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+#(name, value) of the PRAGMA statements run on new SQLite connections, set by init_app
+sqlite_pragmas=[]
+
+def init_app(app):
+    """registers the connection listener with the PRAGMA statements configured for the app."""
+    sqlite_pragmas[:]=list(app.config.get("SQLITE_PRAGMAS",{}).items())
+    if not event.contains(Engine,"connect",on_connect):
+        event.listen(Engine,"connect",on_connect)
+
+def forget_recorded_queries():
+    """drops the statements Flask-SQLAlchemy recorded so far in the current app context, if it records them."""
+    del get_debug_queries()[:]
+
+def on_connect(dbapi_connection,connection_record):
+    """runs the configured PRAGMA statements on a new SQLite connection."""
+    if not isinstance(dbapi_connection,sqlite3.Connection):
+        return
+    cursor=dbapi_connection.cursor()
+    for name,value in sqlite_pragmas:
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
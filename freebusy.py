@@ -0,0 +1,129 @@
+"""Free/busy computations for meetings with any number of participants.
+
+All times are handled as unix timestamps of the naive datetimes stored in the database,
+i.e. the same 'datestamp' convention used by Appointment.to_dict."""
+import datetime, heapq
+
+def to_unix(dt):
+    """converts a naive datetime to the timestamp convention used for appointments."""
+    return dt.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+def from_unix(timestamp):
+    """converts a timestamp back to the naive datetime it was created from."""
+    return datetime.datetime.utcfromtimestamp(timestamp)
+
+def padded(intervals,buffer):
+    """Function pads the sorted (start, end) busy intervals of a user by the buffer of the user in minutes on both sides."""
+    pad=buffer*60
+    return [(start-pad,end+pad) for start,end in intervals]
+
+def merge_busy(interval_lists):
+    """Function merges any number of sorted interval lists into one sorted list of disjoint busy intervals.
+    The lists are swept in start order through a heap, so the cost is O(n log k) for n intervals of k participants."""
+    merged=[]
+    for start,end in heapq.merge(*interval_lists):
+        if merged and start<=merged[-1][1]:
+            if end>merged[-1][1]:
+                merged[-1][1]=end
+        else:
+            merged.append([start,end])
+    return merged
+
+def time_of_day(dt):
+    """returns the time of day of a datetime as timedelta since midnight."""
+    return datetime.timedelta(hours=dt.hour,minutes=dt.minute,seconds=dt.second)
+
+def working_windows(users,start,end):
+    """Generator yields (day, window_start, window_end) for every weekday between start and end, where the window is the
+    intersection of the daily availabilities of all users. The window is None if any of the users is not available that day.
+    Weekends are skipped, as avail_days only covers monday to friday."""
+    earliest=max(time_of_day(user.avail_start) for user in users)
+    latest=min(time_of_day(user.avail_end) for user in users)
+    day=start.replace(hour=0,minute=0,second=0,microsecond=0)
+    while day<end:
+        weekday=day.weekday()
+        if weekday<=4:
+            if any(user.avail_days[weekday]=="n" for user in users):
+                yield day,None
+            else:
+                window_start,window_end=max(day+earliest,start),min(day+latest,end)
+                yield day,(to_unix(window_start),to_unix(window_end)) if window_start<window_end else None
+        day+=datetime.timedelta(days=1)
+
+def free_slots(windows,busy):
+    """Function subtracts the merged busy intervals from the working windows.
+    Returns a list of (day, slots) with slots being the list of free [start, end] intervals within the day's window."""
+    result=[]
+    i=0
+    for day,window in windows:
+        slots=[]
+        if window is not None:
+            window_start,window_end=window
+            #busy intervals are sorted and so are the windows, so intervals that end before this window are done for good
+            while i<len(busy) and busy[i][1]<=window_start:
+                i+=1
+            cursor,j=window_start,i
+            while j<len(busy) and busy[j][0]<window_end:
+                if busy[j][0]>cursor:
+                    slots.append([cursor,busy[j][0]])
+                cursor=max(cursor,busy[j][1])
+                j+=1
+            if cursor<window_end:
+                slots.append([cursor,window_end])
+        result.append((day,slots))
+    return result
+
+def availability(users,intervals,start,end):
+    """Function returns the common free slots of users between the datetimes start and end.
+    intervals holds the sorted (start, end) busy intervals of each user in the same order as users."""
+    busy=merge_busy(padded(user_intervals,user.buffer) for user,user_intervals in zip(users,intervals))
+    return free_slots(working_windows(users,start,end),busy)
+
+def minute_bitmap(intervals,origin,minutes,inner=False):
+    """Function returns the minutes from the timestamp origin on that the (start, end) intervals cover as bits of an int, bit i standing
+    for minute i, limited to the first minutes. Intervals are rounded outwards to whole minutes, or inwards with inner."""
+    bits=0
+    for start,end in intervals:
+        if inner:
+            first,last=-int((origin-start)//60),int((end-origin)//60)
+        else:
+            first,last=int((start-origin)//60),-int((origin-end)//60)
+        first,last=max(first,0),min(last,minutes)
+        if first<last:
+            bits|=((1<<(last-first))-1)<<first
+    return bits
+
+def free_bitmap(user,intervals,start,end,origin):
+    """Function returns the free minutes of the user between the datetimes start and end as bitmap from the timestamp origin on:
+    the minutes within the user's daily availability that are not covered by the sorted (start, end) busy intervals padded by the buffer."""
+    minutes=int((to_unix(end)-origin)//60)
+    windows=[window for _,window in working_windows([user],start,end) if window is not None]
+    return minute_bitmap(windows,origin,minutes,inner=True)&~minute_bitmap(padded(intervals,user.buffer),origin,minutes)
+
+def bitmap_slots(bits,origin):
+    """Generator yields the [start, end] timestamps of the runs of set bits of a minute bitmap from the timestamp origin on."""
+    offset=0
+    while bits:
+        #skip the free minutes, then count the set ones
+        skip=(bits&-bits).bit_length()-1
+        bits>>=skip
+        offset+=skip
+        run=(bits^(bits+1)).bit_length()-1
+        yield [origin+offset*60,origin+(offset+run)*60]
+        bits>>=run
+        offset+=run
+
+def team_availability(users,intervals,start,end):
+    """Function returns the common free slots of the whole team of users and of every pair of them between the datetimes start and end
+    as (group, pairs), with pairs mapping the indices (i, j), i<j, of two users to their slots. intervals holds the sorted (start, end)
+    busy intervals of each user in the same order as users. The free minutes of each user are computed once as bitmap of an int,
+    which makes the slots of a pair a single AND instead of a merge of their busy intervals."""
+    origin=to_unix(start.replace(second=0,microsecond=0))
+    if origin<to_unix(start):
+        origin+=60
+    free=[free_bitmap(user,user_intervals,start,end,origin) for user,user_intervals in zip(users,intervals)]
+    group=free[0]
+    for bits in free[1:]:
+        group&=bits
+    pairs={(i,j):list(bitmap_slots(free[i]&free[j],origin)) for i in range(len(users)) for j in range(i+1,len(users))}
+    return list(bitmap_slots(group,origin)),pairs
@@ -0,0 +1,235 @@
+"""iCalendar (RFC 5545) export and import of appointments.
+
+Both directions work on streams: the export yields the text of a calendar in chunks of events, the import reads
+lines from an iterator of byte chunks and yields one appointment per VEVENT, so neither holds a whole file in memory.
+Appointments map to events with DTSTART in UTC and a DURATION in minutes, their recurrence rules to RRULE and EXDATE.
+The import understands the subset of RRULE the recurrence rules can express: FREQ DAILY, WEEKLY or MONTHLY with
+COUNT and UNTIL, events with other rules are reported and skipped."""
+import datetime, itertools, re, zoneinfo
+
+#events per chunk of the export
+CHUNK_EVENTS=100
+
+#lines are folded after this many octets, the continuation lines start with a space
+LINE_OCTETS=75
+
+FREQUENCIES={"DAILY":"daily","WEEKLY":"weekly","MONTHLY":"monthly"}
+
+DURATION=re.compile(r"^([+-]?)P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$")
+
+def escape(text):
+    """escapes a text value."""
+    return text.replace("\\","\\\\").replace(";","\\;").replace(",","\\,").replace("\r","").replace("\n","\\n")
+
+def unescape(text):
+    """reverts the escaping of a text value."""
+    return re.sub(r"\\(.)",lambda match:"\n" if match.group(1) in "nN" else match.group(1),text)
+
+def fold(line):
+    """Function folds a content line into lines of at most LINE_OCTETS octets, without splitting UTF-8 sequences, and terminates them with CRLF."""
+    encoded=line.encode()
+    if len(encoded)<=LINE_OCTETS:
+        return line+"\r\n"
+    parts,start,limit=[],0,LINE_OCTETS
+    while start<len(encoded):
+        end=min(start+limit,len(encoded))
+        #continuation bytes of UTF-8 sequences start with the bits 10
+        while end<len(encoded) and encoded[end]&0xC0==0x80:
+            end-=1
+        parts.append(encoded[start:end].decode())
+        start,limit=end,LINE_OCTETS-1
+    return "\r\n ".join(parts)+"\r\n"
+
+def format_time(dt):
+    """formats a naive UTC datetime as UTC date-time value."""
+    return dt.strftime("%Y%m%dT%H%M%SZ")
+
+def header(name):
+    """returns the lines starting a calendar with the name."""
+    return "".join(fold(line) for line in ("BEGIN:VCALENDAR","VERSION:2.0","PRODID:-//calendar//API//EN",f"X-WR-CALNAME:{escape(name)}"))
+
+FOOTER=fold("END:VCALENDAR")
+
+def event(appointment,stamp):
+    """Function returns the VEVENT of an appointment as text, stamp is the DTSTAMP of the export."""
+    lines=[
+        "BEGIN:VEVENT",
+        f"UID:{appointment.id}@calendar",
+        f"DTSTAMP:{stamp}",
+        f"DTSTART:{format_time(appointment.date)}",
+        f"DURATION:PT{appointment.duration}M",
+        f"SUMMARY:{escape(appointment.name)}"
+    ]
+    if appointment.repeat is not None:
+        rule=f"RRULE:FREQ={appointment.repeat.upper()}"
+        if appointment.repeat_count is not None:
+            rule+=f";COUNT={appointment.repeat_count}"
+        if appointment.repeat_until is not None:
+            rule+=f";UNTIL={format_time(appointment.repeat_until)}"
+        lines.append(rule)
+        #excluded occurrences are identified by their start, which is on the excluded day at the time of the first occurrence
+        days=sorted(appointment.repeat_except.split(",")) if appointment.repeat_except else []
+        if len(days)>0:
+            lines.append("EXDATE:"+",".join(format_time(datetime.datetime.combine(datetime.date.fromisoformat(day),appointment.date.time())) for day in days))
+    lines.append("END:VEVENT")
+    return "".join(fold(line) for line in lines)
+
+def export(name,appointments):
+    """Generator yields the text of a calendar with the name holding the appointments, in chunks of CHUNK_EVENTS events.
+    appointments can be any iterable, e.g. a query read with yield_per."""
+    stamp=format_time(datetime.datetime.utcnow())
+    chunk=[header(name)]
+    for appointment in appointments:
+        chunk.append(event(appointment,stamp))
+        if len(chunk)>=CHUNK_EVENTS:
+            yield "".join(chunk)
+            chunk=[]
+    chunk.append(FOOTER)
+    yield "".join(chunk)
+
+def lines(chunks):
+    """Generator yields the unfolded content lines of an iCalendar text given as iterator of byte chunks, together with the number
+    of the physical line they start on. Only the current line is held in memory."""
+    logical,start,number,rest=None,0,0,b""
+    #None marks the end of the text, after which the rest is the last line
+    for chunk in itertools.chain(chunks,[None]):
+        if chunk is None:
+            physical,rest=[rest],b""
+        else:
+            *physical,rest=(rest+chunk).split(b"\n")
+        for line in physical:
+            number+=1
+            line=line.rstrip(b"\r").decode("utf-8",errors="replace")
+            #a line starting with a space or tab continues the previous one
+            if line[:1] in (" ","\t") and logical is not None:
+                logical+=line[1:]
+                continue
+            if logical:
+                yield start,logical
+            logical,start=line,number
+    if logical:
+        yield start,logical
+
+def split(line):
+    """Function splits a content line into its upper cased name, its parameters as dict and its value."""
+    quoted=False
+    for index,character in enumerate(line):
+        if character=='"':
+            quoted=not quoted
+        elif character==":" and not quoted:
+            break
+    else:
+        raise ValueError(f"'{line[:40]}' is not a content line")
+    name,*parameters=re.findall(r'(?:[^;"]|"[^"]*")+',line[:index])
+    return name.upper(),{key.upper():value.strip('"') for key,_,value in (parameter.partition("=") for parameter in parameters)},line[index+1:]
+
+def parse_time(value,parameters):
+    """Function parses a DATE or DATE-TIME value into a naive UTC datetime. Returns (datetime, whether it is a date).
+    Times with a TZID are converted to UTC, floating times are taken as UTC like all times of the API."""
+    if parameters.get("VALUE")=="DATE" or len(value)==8:
+        return datetime.datetime.strptime(value,"%Y%m%d"),True
+    dt=datetime.datetime.strptime(value.rstrip("Z"),"%Y%m%dT%H%M%S")
+    if not value.endswith("Z") and "TZID" in parameters:
+        try:
+            zone=zoneinfo.ZoneInfo(parameters["TZID"])
+        except (zoneinfo.ZoneInfoNotFoundError,ValueError):
+            raise ValueError(f"unknown time zone '{parameters['TZID']}'")
+        dt=dt.replace(tzinfo=zone).astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return dt,False
+
+def parse_duration(value):
+    """returns a DURATION value in minutes."""
+    match=DURATION.match(value)
+    if match is None or value in ("P","PT"):
+        raise ValueError(f"invalid DURATION '{value}'")
+    sign,weeks,days,hours,minutes,seconds=match.groups()
+    total=int(weeks or 0)*7*24*60+int(days or 0)*24*60+int(hours or 0)*60+int(minutes or 0)+int(seconds or 0)//60
+    return -total if sign=="-" else total
+
+def until(value):
+    """returns the last possible start of an occurrence for an UNTIL value, which includes the whole day if it is a date."""
+    dt,is_date=parse_time(value,{})
+    return dt+datetime.timedelta(days=1,seconds=-1) if is_date else dt
+
+def parse_rule(value):
+    """Function parses an RRULE value into the recurrence columns of an appointment. Rules the recurrence rules cannot express raise ValueError."""
+    parts={key.upper():part for key,_,part in (item.partition("=") for item in value.split(";"))}
+    if parts.get("FREQ") not in FREQUENCIES:
+        raise ValueError(f"unsupported RRULE frequency '{parts.get('FREQ')}'")
+    unsupported=set(parts)-{"FREQ","COUNT","UNTIL","WKST","INTERVAL"}
+    if len(unsupported)>0 or parts.get("INTERVAL","1")!="1":
+        raise ValueError(f"unsupported RRULE '{value}'")
+    count=int(parts["COUNT"]) if "COUNT" in parts else None
+    if count is not None and count<1:
+        raise ValueError("RRULE COUNT must be positive")
+    return {
+        "repeat":FREQUENCIES[parts["FREQ"]],
+        "repeat_count":count,
+        "repeat_until":until(parts["UNTIL"]) if "UNTIL" in parts else None,
+        "repeat_except":None
+    }
+
+def appointment(properties):
+    """Function turns the (name, parameters, value) properties of a VEVENT into the (name, start, duration, rule) item of
+    upsert_appointments. Events without RRULE are single appointments."""
+    values={}
+    exceptions=set()
+    for name,parameters,value in properties:
+        if name=="EXDATE":
+            exceptions|={parse_time(day,parameters)[0].date() for day in value.split(",")}
+        else:
+            values.setdefault(name,(parameters,value))
+    if "SUMMARY" not in values or "DTSTART" not in values:
+        raise ValueError("SUMMARY and DTSTART are required")
+    start,all_day=parse_time(values["DTSTART"][1],values["DTSTART"][0])
+    if "DTEND" in values:
+        duration=int((parse_time(values["DTEND"][1],values["DTEND"][0])[0]-start).total_seconds()//60)
+    elif "DURATION" in values:
+        duration=parse_duration(values["DURATION"][1])
+    else:
+        #RFC 5545: a date lasts one day, a date-time ends when it starts
+        duration=24*60 if all_day else 0
+    if duration<0:
+        raise ValueError("the event ends before it starts")
+    rule={"repeat":None,"repeat_count":None,"repeat_until":None,"repeat_except":None}
+    if "RRULE" in values:
+        rule=parse_rule(values["RRULE"][1])
+        rule["repeat_except"]=",".join(sorted(day.isoformat() for day in exceptions)) or None
+    return unescape(values["SUMMARY"][1]),start,duration,rule
+
+def events(chunks):
+    """Generator parses an iCalendar text given as iterator of byte chunks and yields (item, error) per VEVENT, with item being
+    the (name, start, duration, rule) of the appointment or None if the event could not be imported, and error describing why.
+    Components nested into events, like alarms, are skipped. Raises ValueError if the text does not start a VCALENDAR."""
+    properties,start,depth,started=None,0,0,False
+    for number,line in lines(chunks):
+        upper=line.strip().upper()
+        if not started:
+            #editors may prepend a byte order mark
+            upper=upper.lstrip("\ufeff")
+            if upper!="BEGIN:VCALENDAR":
+                raise ValueError("The body is not an iCalendar text, it must start with BEGIN:VCALENDAR")
+            started=True
+            continue
+        if properties is None:
+            if upper=="BEGIN:VEVENT":
+                properties,start,depth=[],number,0
+            continue
+        if upper.startswith("BEGIN:"):
+            depth+=1
+        elif upper.startswith("END:") and depth>0:
+            depth-=1
+        elif upper=="END:VEVENT":
+            try:
+                yield appointment(properties),None
+            except ValueError as error:
+                yield None,f"event at line {start}: {error}"
+            properties=None
+        elif depth==0:
+            try:
+                properties.append(split(line))
+            except ValueError as error:
+                yield None,f"event at line {start}: {error}"
+                properties=None
+    if properties is not None:
+        yield None,f"event at line {start}: END:VEVENT is missing"
@@ -0,0 +1,86 @@
+"""In-process queue of background jobs.
+
+Requests whose work grows with their input, like sharing a calendar with hundreds of users, submit it as a job and
+answer with its id right away. The jobs run on a thread pool, each within its own application context and therefore
+with its own database session, and report their progress while they go. Jobs and their status live in the memory
+of one process, like the busy cache, so the app is served by a single worker process."""
+import collections, logging, secrets, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+logger=logging.getLogger(__name__)
+
+class Job(object):
+    """State of a job: 'queued', 'running', 'done' or 'failed', with done out of total items processed."""
+
+    def __init__(self,kind,total):
+        self.id=secrets.token_hex(nbytes=8)
+        self.kind=kind
+        self.state="queued"
+        self.total=total
+        self.done=0
+        self.result=None
+        self.error=None
+        self.created=time.time()
+        self.finished=None
+
+    def to_dict(self):
+        return {
+            "id":self.id,
+            "kind":self.kind,
+            "state":self.state,
+            "done":self.done,
+            "total":self.total,
+            "result":self.result,
+            "error":self.error
+        }
+
+class Jobs(object):
+    """Thread pool running the jobs of a Flask app with max_workers threads. Finished jobs are kept for status requests,
+    the oldest are dropped beyond max_finished."""
+
+    def __init__(self,app,max_workers=2,max_finished=1000):
+        self.app=app
+        self.max_finished=max_finished
+        self.executor=ThreadPoolExecutor(max_workers=max_workers,thread_name_prefix="job")
+        self.jobs={}
+        self.finished=collections.deque()
+        self.lock=threading.Lock()
+
+    def submit(self,kind,total,work):
+        """Function queues work(progress) as job and returns the job. work runs within an application context, calls progress(done)
+        with the number of processed items whenever it made progress and returns the result of the job."""
+        job=Job(kind,total)
+        with self.lock:
+            self.jobs[job.id]=job
+        self.executor.submit(self.run,job,work)
+        return job
+
+    def run(self,job,work):
+        """runs the work of a job in a worker thread and records its outcome."""
+        job.state="running"
+        def progress(done):
+            job.done=done
+        try:
+            with self.app.app_context():
+                job.result=work(progress)
+            job.state="done"
+        except Exception as error:
+            logger.exception(f"Job {job.id} ({job.kind}) failed")
+            job.error=str(error)
+            job.state="failed"
+        job.finished=time.time()
+        with self.lock:
+            self.finished.append(job.id)
+            while len(self.finished)>self.max_finished:
+                self.jobs.pop(self.finished.popleft(),None)
+
+    def get(self,job_id):
+        """returns the job with the id or None if it does not exist (anymore)."""
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def stats(self):
+        """returns the number of jobs per state."""
+        with self.lock:
+            states=collections.Counter(job.state for job in self.jobs.values())
+        return {state:states.get(state,0) for state in ("queued","running","done","failed")}
@@ -0,0 +1,173 @@
+"""Request instrumentation of the calendar API.
+
+Every request is timed and every SQL statement it issues is counted and timed through SQLAlchemy cursor events.
+The numbers are aggregated per endpoint and exposed in the Prometheus text format. Requests slower than
+Config.SLOW_REQUEST_SECONDS are logged together with their SQL statements.
+The Flask app is instrumented by request hooks, the ASGI app of asgi.py by MetricsMiddleware. The statements of an ASGI
+request run in thread pool workers, which see the statistics of their request through a context variable."""
+import bisect, contextvars, logging, threading, time
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger=logging.getLogger(__name__)
+
+#upper bounds of the latency histogram buckets in seconds
+BUCKETS=(0.005,0.01,0.025,0.05,0.1,0.25,0.5,1.0,2.5,5.0,10.0)
+
+#at most this many statements are kept per request for the slow request log
+MAX_LOGGED_STATEMENTS=50
+
+#statistics of the ASGI request being handled, copied into the thread pool calls of the request
+current_request=contextvars.ContextVar("current_request",default=None)
+
+class RequestStats(object):
+    """Duration and SQL statements of a single request."""
+
+    def __init__(self):
+        self.start=time.perf_counter()
+        self.sql_count=0
+        self.sql_seconds=0.0
+        self.sql_statements=[]
+
+class Metrics(object):
+    """Collects per endpoint request latencies and SQL statistics of a Flask app and serves them at /metrics."""
+
+    def __init__(self,app=None):
+        self.lock=threading.Lock()
+        self.requests={}
+        self.histograms={}
+        self.queries={}
+        self.sql_seconds={}
+        self.gauges=[]
+        self.slow_request_seconds=None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self,app):
+        """registers the request hooks, the SQL listeners and the /metrics endpoint with the app."""
+        self.slow_request_seconds=app.config.get("SLOW_REQUEST_SECONDS")
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.add_url_rule("/metrics","metrics",self.view)
+        if not event.contains(Engine,"before_cursor_execute",before_cursor_execute):
+            event.listen(Engine,"before_cursor_execute",before_cursor_execute)
+            event.listen(Engine,"after_cursor_execute",after_cursor_execute)
+
+    def register(self,name,description,kind,collect):
+        """adds a metric whose value is read from collect() whenever the metrics are rendered. kind is 'gauge' or 'counter'."""
+        self.gauges.append((name,description,kind,collect))
+
+    def before_request(self):
+        g.metrics_request=RequestStats()
+
+    def after_request(self,response):
+        if "metrics_request" not in g:
+            return response
+        self.record(g.metrics_request,request.endpoint or "unmatched",request.method,response.status_code,request.path)
+        return response
+
+    def record(self,stats,endpoint,method,status,path):
+        """adds a finished request to the statistics of its endpoint and logs it if it was slow."""
+        duration=time.perf_counter()-stats.start
+        with self.lock:
+            key=(endpoint,method,status)
+            self.requests[key]=self.requests.get(key,0)+1
+            histogram=self.histograms.setdefault(endpoint,[[0]*(len(BUCKETS)+1),0.0])
+            histogram[0][bisect.bisect_left(BUCKETS,duration)]+=1
+            histogram[1]+=duration
+            self.queries[endpoint]=self.queries.get(endpoint,0)+stats.sql_count
+            self.sql_seconds[endpoint]=self.sql_seconds.get(endpoint,0.0)+stats.sql_seconds
+        if self.slow_request_seconds is not None and duration>self.slow_request_seconds:
+            statements="\n".join(f"  {seconds*1000:.1f} ms: {statement}" for statement,seconds in stats.sql_statements)
+            logger.warning(f"Slow request {method} {path} ({endpoint}) took {duration*1000:.1f} ms "
+                f"with {stats.sql_count} queries taking {stats.sql_seconds*1000:.1f} ms:\n{statements}")
+
+    def render(self):
+        """Function returns all metrics in the Prometheus text exposition format."""
+        lines=[]
+        with self.lock:
+            lines.append("# HELP calendar_requests_total Requests handled, by endpoint, method and status.")
+            lines.append("# TYPE calendar_requests_total counter")
+            for (endpoint,method,status),count in sorted(self.requests.items()):
+                lines.append(f'calendar_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}')
+
+            lines.append("# HELP calendar_request_duration_seconds Request latency, by endpoint.")
+            lines.append("# TYPE calendar_request_duration_seconds histogram")
+            for endpoint,(counts,total) in sorted(self.histograms.items()):
+                cumulative=0
+                for bound,count in zip(BUCKETS+("+Inf",),counts):
+                    cumulative+=count
+                    lines.append(f'calendar_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {cumulative}')
+                lines.append(f'calendar_request_duration_seconds_sum{{endpoint="{endpoint}"}} {total}')
+                lines.append(f'calendar_request_duration_seconds_count{{endpoint="{endpoint}"}} {cumulative}')
+
+            lines.append("# HELP calendar_sql_queries_total SQL statements issued, by endpoint.")
+            lines.append("# TYPE calendar_sql_queries_total counter")
+            for endpoint,count in sorted(self.queries.items()):
+                lines.append(f'calendar_sql_queries_total{{endpoint="{endpoint}"}} {count}')
+
+            lines.append("# HELP calendar_sql_duration_seconds_total Time spent executing SQL statements, by endpoint.")
+            lines.append("# TYPE calendar_sql_duration_seconds_total counter")
+            for endpoint,seconds in sorted(self.sql_seconds.items()):
+                lines.append(f'calendar_sql_duration_seconds_total{{endpoint="{endpoint}"}} {seconds}')
+
+        for name,description,kind,collect in self.gauges:
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {collect()}")
+        return "\n".join(lines)+"\n"
+
+    def view(self):
+        return Response(self.render(),mimetype="text/plain; version=0.0.4")
+
+class MetricsMiddleware(object):
+    """ASGI middleware collecting the statistics of the HTTP requests of an ASGI app into metrics, like the request hooks
+    of the Flask app. Requests are attributed to the lower cased name of their endpoint, as Flask-RESTful names them."""
+
+    def __init__(self,app,metrics):
+        self.app=app
+        self.metrics=metrics
+
+    async def __call__(self,scope,receive,send):
+        if scope["type"]!="http":
+            await self.app(scope,receive,send)
+            return
+        stats=RequestStats()
+        token=current_request.set(stats)
+        status=[500]
+        async def send_status(message):
+            if message["type"]=="http.response.start":
+                status[0]=message["status"]
+            await send(message)
+        try:
+            await self.app(scope,receive,send_status)
+        finally:
+            current_request.reset(token)
+            #the router adds the matched endpoint to the scope
+            endpoint=scope.get("endpoint")
+            self.metrics.record(stats,endpoint.__name__.lower() if endpoint is not None else "unmatched",scope["method"],status[0],scope["path"])
+
+def request_stats():
+    """returns the statistics of the ASGI or Flask request being handled, None outside of requests."""
+    stats=current_request.get()
+    if stats is None and has_request_context():
+        stats=g.get("metrics_request")
+    return stats
+
+def before_cursor_execute(conn,cursor,statement,parameters,context,executemany):
+    """remembers the start of a statement issued within a request."""
+    if request_stats() is not None:
+        conn.info.setdefault("metrics_query_start",[]).append(time.perf_counter())
+
+def after_cursor_execute(conn,cursor,statement,parameters,context,executemany):
+    """adds a finished statement to the statistics of the current request."""
+    starts=conn.info.get("metrics_query_start")
+    stats=request_stats()
+    if not starts or stats is None:
+        return
+    seconds=time.perf_counter()-starts.pop()
+    stats.sql_count+=1
+    stats.sql_seconds+=seconds
+    if len(stats.sql_statements)<MAX_LOGGED_STATEMENTS:
+        stats.sql_statements.append((statement,seconds))
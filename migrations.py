@@ -0,0 +1,262 @@
+"""Versioned schema migrations for the calendar database.
+
+Every migration is applied at most once and records its version in the table 'schema_version'.
+Migrations check the current state of the schema before changing it, so they can upgrade a database
+that was created by an older version of models.py as well as an empty one.
+Each migration carries its own definition of the tables, columns and indexes it creates instead of reading models.py,
+so it does the same on every database no matter how the models changed since it was written.
+Run 'python migrations.py' to upgrade the database of the configuration profile in place, see config.py."""
+import contextlib
+from sqlalchemy import MetaData, Table, Column, Integer, SmallInteger, String, Text, DateTime, ForeignKey, Index, bindparam, inspect, select
+from sqlalchemy.exc import OperationalError
+from models import db, epoch
+
+version_metadata=MetaData()
+schema_version=Table('schema_version',version_metadata,Column('version',Integer,nullable=False))
+
+def create_missing_indexes(connection,indexes):
+    """Function creates the indexes given as (name, table, columns) that do not exist in the database yet.
+    Every migration lists the indexes it owns, indexes declared on the models later are created by later migrations."""
+    quote=connection.dialect.identifier_preparer.quote
+    for name,table,columns in indexes:
+        existing={index["name"] for index in inspect(connection).get_indexes(table)}
+        if name not in existing:
+            connection.execute(f"CREATE INDEX {quote(name)} ON {quote(table)} ({', '.join(quote(column) for column in columns)})")
+
+def add_missing_columns(connection,table,columns):
+    """Function adds the columns given as (name, type, server default) that do not exist in the table yet.
+    Existing rows get the server default of the column, columns without one are nullable, as existing rows get NULL.
+    Names are quoted, as some are reserved words in MySQL, e.g. 'repeat'."""
+    existing={column["name"] for column in inspect(connection).get_columns(table)}
+    quote=connection.dialect.identifier_preparer.quote
+    for name,type_,default in columns:
+        if name not in existing:
+            definition=type_.compile(dialect=connection.dialect)
+            if default is not None:
+                definition+=f" DEFAULT {default} NOT NULL"
+            connection.execute(f"ALTER TABLE {quote(table)} ADD COLUMN {quote(name)} {definition}")
+
+def initial_schema(connection):
+    """Creates the tables of the original data model."""
+    metadata=MetaData()
+    Table('user',metadata,
+        Column('name',String(20),primary_key=True),
+        Column('secret',String(8),nullable=False),
+        Column('avail_days',String(5)),
+        Column('avail_start',DateTime()),
+        Column('avail_end',DateTime()),
+        Column('buffer',SmallInteger))
+    Table('calendar',metadata,
+        Column('id',Integer,primary_key=True),
+        Column('name',String(50),nullable=False),
+        Column('owned_by',String(8),ForeignKey('user.name'),nullable=False))
+    Table('uc_association',metadata,
+        Column('user_name',String(20),ForeignKey('user.name'),primary_key=True),
+        Column('calendar_id',Integer,ForeignKey('calendar.id'),primary_key=True),
+        Column('status',String(20)))
+    Table('appointment',metadata,
+        Column('id',Integer,primary_key=True),
+        Column('name',String(100),nullable=False),
+        Column('date',DateTime(),nullable=False),
+        Column('duration',SmallInteger,nullable=False),
+        Column('origin_id',Integer,ForeignKey('calendar.id'),nullable=False))
+    Table('ca_association',metadata,
+        Column('calendar_id',Integer,ForeignKey('calendar.id'),primary_key=True),
+        Column('appointment_id',Integer,ForeignKey('appointment.id'),primary_key=True),
+        Column('status',String(20)))
+    metadata.create_all(connection,checkfirst=True)
+
+def hot_lookup_indexes(connection):
+    """Adds the composite indexes for the calendar, association and appointment lookups done by every request."""
+    create_missing_indexes(connection,[
+        ('ix_calendar_owned_by_name','calendar',('owned_by','name')),
+        ('ix_uc_association_user_name_status','uc_association',('user_name','status')),
+        ('ix_appointment_origin_id_name_date','appointment',('origin_id','name','date')),
+        ('ix_ca_association_appointment_id','ca_association',('appointment_id',)),
+    ])
+
+def appointment_fulltext(connection):
+    """Adds an FTS5 index over the appointment names, kept in sync with the appointment table by triggers.
+    Only SQLite builds with FTS5 get the index, searches fall back to substring matching without it."""
+    if connection.dialect.name!="sqlite":
+        return
+    try:
+        connection.execute("CREATE VIRTUAL TABLE IF NOT EXISTS appointment_fts USING fts5(name, content='appointment', content_rowid='id', prefix='2 3')")
+    except OperationalError:
+        return
+    fulltext_triggers(connection)
+    #index the appointments that existed before the triggers
+    connection.execute("INSERT INTO appointment_fts(appointment_fts) VALUES ('rebuild')")
+
+def fulltext_triggers(connection):
+    """Creates the triggers that keep the full-text index of appointment_fulltext in sync with the appointment table."""
+    connection.execute("""CREATE TRIGGER IF NOT EXISTS appointment_fts_insert AFTER INSERT ON appointment BEGIN
+        INSERT INTO appointment_fts(rowid, name) VALUES (new.id, new.name);
+    END""")
+    connection.execute("""CREATE TRIGGER IF NOT EXISTS appointment_fts_delete AFTER DELETE ON appointment BEGIN
+        INSERT INTO appointment_fts(appointment_fts, rowid, name) VALUES ('delete', old.id, old.name);
+    END""")
+    connection.execute("""CREATE TRIGGER IF NOT EXISTS appointment_fts_update AFTER UPDATE OF name ON appointment BEGIN
+        INSERT INTO appointment_fts(appointment_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        INSERT INTO appointment_fts(rowid, name) VALUES (new.id, new.name);
+    END""")
+
+def appointment_recurrence(connection):
+    """Adds the columns of the recurrence rule to the appointments."""
+    add_missing_columns(connection,'appointment',[
+        ('repeat',String(10),None),
+        ('repeat_count',Integer(),None),
+        ('repeat_until',DateTime(),None),
+        ('repeat_except',Text(),None),
+    ])
+
+def resource_versions(connection):
+    """Adds the version counters of users and calendars that the ETags are derived from."""
+    for table in ('user','calendar'):
+        add_missing_columns(connection,table,[('version',Integer(),1)])
+
+def appointment_epochs(connection):
+    """Adds the unix timestamps of start and end to the appointments, computed from date and duration in batches of 1000 rows."""
+    add_missing_columns(connection,'appointment',[('start_epoch',Integer(),None),('end_epoch',Integer(),None)])
+    table=Table('appointment',MetaData(),
+        Column('id',Integer,primary_key=True),
+        Column('date',DateTime()),
+        Column('duration',SmallInteger),
+        Column('start_epoch',Integer),
+        Column('end_epoch',Integer))
+    query=select([table.c.id,table.c.date,table.c.duration]).order_by(table.c.id).limit(1000)
+    last_id=None
+    while True:
+        rows=connection.execute(query if last_id is None else query.where(table.c.id>last_id)).fetchall()
+        if len(rows)==0:
+            break
+        last_id=rows[-1][0]
+        connection.execute(table.update().where(table.c.id==bindparam('row_id')).values(start_epoch=bindparam('start'),end_epoch=bindparam('end')),
+            [{'row_id':row_id,'start':epoch(date),'end':epoch(date)+duration*60} for row_id,date,duration in rows])
+    create_missing_indexes(connection,[('ix_appointment_start_epoch','appointment',('start_epoch',))])
+
+def change_log(connection):
+    """Creates the change log read by the sync endpoint."""
+    metadata=MetaData()
+    Table('change_log',metadata,
+        Column('id',Integer,primary_key=True),
+        Column('kind',String(20),nullable=False),
+        Column('calendar_id',Integer,ForeignKey('calendar.id'),nullable=False),
+        Column('appointment_id',Integer),
+        Column('name',String(100)),
+        Column('start_epoch',Integer),
+        Column('user_name',String(20)),
+        Index('ix_change_log_calendar_id_id','calendar_id','id'))
+    #the foreign key needs the referenced table in the same metadata
+    Table('calendar',metadata,Column('id',Integer,primary_key=True))
+    metadata.create_all(connection,tables=[metadata.tables['change_log']],checkfirst=True)
+
+def appointment_autoincrement(connection):
+    """Rebuilds the appointment table of SQLite databases with AUTOINCREMENT. SQLite otherwise gives the id of the newest deleted
+    appointment to the next one, and the change log would mix up both appointments. MySQL and PostgreSQL never reuse ids."""
+    if connection.dialect.name!="sqlite":
+        return
+    definition=connection.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='appointment'").scalar()
+    if "AUTOINCREMENT" in definition.upper():
+        return
+    metadata=MetaData()
+    rebuilt=Table('appointment_rebuilt',metadata,
+        Column('id',Integer,primary_key=True),
+        Column('name',String(100),nullable=False),
+        Column('date',DateTime(),nullable=False),
+        Column('duration',SmallInteger,nullable=False),
+        Column('origin_id',Integer,ForeignKey('calendar.id'),nullable=False),
+        Column('repeat',String(10)),
+        Column('repeat_count',Integer),
+        Column('repeat_until',DateTime()),
+        Column('repeat_except',Text),
+        Column('start_epoch',Integer),
+        Column('end_epoch',Integer),
+        sqlite_autoincrement=True)
+    Table('calendar',metadata,Column('id',Integer,primary_key=True))
+    #left behind by a failed run of an earlier version of this migration, which did not roll back the DDL
+    connection.execute("DROP TABLE IF EXISTS appointment_rebuilt")
+    rebuilt.create(connection)
+    columns=', '.join(column.name for column in rebuilt.columns)
+    connection.execute(f"INSERT INTO appointment_rebuilt ({columns}) SELECT {columns} FROM appointment")
+    #dropping the table drops its indexes and full-text triggers as well, the full-text index keeps its rows as the ids stay the same
+    connection.execute("DROP TABLE appointment")
+    connection.execute("ALTER TABLE appointment_rebuilt RENAME TO appointment")
+    #ids of appointments deleted before the rebuild stay retired too, as far as the change log knows them
+    connection.execute("DELETE FROM sqlite_sequence WHERE name='appointment'")
+    connection.execute("""INSERT INTO sqlite_sequence(name, seq) SELECT 'appointment',
+        max(coalesce((SELECT max(id) FROM appointment),0), coalesce((SELECT max(appointment_id) FROM change_log),0))""")
+    create_missing_indexes(connection,[
+        ('ix_appointment_origin_id_name_date','appointment',('origin_id','name','date')),
+        ('ix_appointment_start_epoch','appointment',('start_epoch',)),
+    ])
+    if connection.dialect.has_table(connection,'appointment_fts'):
+        fulltext_triggers(connection)
+
+def appointment_end_index(connection):
+    """Adds the index on the end and start timestamps of the appointments, which busy lookups select by overlap."""
+    create_missing_indexes(connection,[('ix_appointment_end_epoch_start_epoch','appointment',('end_epoch','start_epoch'))])
+
+#ordered list of (version, description, migration). Append new migrations with the next version number.
+MIGRATIONS=[
+    (1,"initial schema",initial_schema),
+    (2,"composite indexes on hot lookup columns",hot_lookup_indexes),
+    (3,"full-text index on appointment names",appointment_fulltext),
+    (4,"recurrence rules of appointments",appointment_recurrence),
+    (5,"version counters of users and calendars",resource_versions),
+    (6,"unix timestamps of appointment start and end",appointment_epochs),
+    (7,"change log of calendars and appointments",change_log),
+    (8,"ids of deleted appointments are not reused",appointment_autoincrement),
+    (9,"index on appointment end and start timestamps",appointment_end_index),
+]
+
+def current_version(connection):
+    """Function returns the schema version of the database, 0 for a database that has never been migrated."""
+    schema_version.create(connection,checkfirst=True)
+    version=connection.execute(schema_version.select()).scalar()
+    if version is None:
+        connection.execute(schema_version.insert().values(version=0))
+        return 0
+    return version
+
+@contextlib.contextmanager
+def transaction(engine):
+    """Context manager yields a connection within a transaction that is committed at the end, or rolled back on an exception.
+    pysqlite only opens a transaction before INSERT, UPDATE and DELETE and commits CREATE, ALTER and DROP on their own,
+    so on SQLite the transaction is begun with an explicit BEGIN instead, which covers the DDL as well.
+    MySQL commits DDL implicitly in any case, a failed migration there can leave the schema partially changed."""
+    with engine.connect() as connection:
+        if connection.dialect.name!="sqlite":
+            with connection.begin():
+                yield connection
+            return
+        dbapi_connection=connection.connection.connection
+        isolation_level=dbapi_connection.isolation_level
+        dbapi_connection.isolation_level=None
+        try:
+            with connection.begin():
+                connection.execute("BEGIN")
+                yield connection
+        finally:
+            dbapi_connection.isolation_level=isolation_level
+
+def upgrade(engine,target=None):
+    """Function applies all migrations newer than the database's schema version up to target (default: latest).
+    Each migration runs in its own transaction together with the update of the version number, so on SQLite a failed migration
+    leaves the database at the previous version. See transaction for MySQL.
+    Returns the resulting schema version."""
+    with transaction(engine) as connection:
+        version=current_version(connection)
+    for number,description,migration in MIGRATIONS:
+        if number<=version or (target is not None and number>target):
+            continue
+        with transaction(engine) as connection:
+            migration(connection)
+            connection.execute(schema_version.update().values(version=number))
+        version=number
+    return version
+
+if __name__=='__main__':
+    from api import app
+    with app.app_context():
+        print(f"Database schema is at version {upgrade(db.engine)}.")
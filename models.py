@@ -1,6 +1,7 @@
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.ext.declarative import DeclarativeMeta
 import datetime
+import recurrence
 
 db=SQLAlchemy()
 
@@ -12,15 +13,17 @@ class User(db.Model):
     avail_start=db.Column(db.DateTime(),default=datetime.datetime(year=datetime.MINYEAR,month=1,day=1,hour=9,minute=0))
     avail_end=db.Column(db.DateTime(),default=datetime.datetime(year=datetime.MINYEAR,month=1,day=1,hour=18,minute=0))
     buffer=db.Column(db.SmallInteger,default=15)
-    calendars=db.relationship('UC_Association',backref='user',cascade="all, delete",lazy=True)
+    #bumped by every write that changes the user's calendar associations, part of the user's ETag
+    version=db.Column(db.Integer,nullable=False,default=1,server_default="1")
+    calendars=db.relationship('UC_Association',backref='user',cascade="all, delete",lazy=True,order_by='UC_Association.calendar_id')
 
     def __repr__(self):
         return 'Name: '+self.name+', Secret: '+self.secret
 
-    def to_dict(self):
+    def to_dict(self,readable=True):
         calendars=[]
         for association in self.calendars:
-            calendars.append(association.to_dict())
+            calendars.append(association.to_dict(readable))
         return {
             'name':self.name,
             'availability':{
@@ -36,9 +39,13 @@ class UC_Association(db.Model):
     user_name=db.Column(db.String(20),db.ForeignKey("user.name"),primary_key=True)
     calendar_id=db.Column(db.Integer,db.ForeignKey("calendar.id"),primary_key=True)
     status=db.Column(db.String(20),default="pending")
+    __table_args__=(
+        #default calendar lookups filter on the user and the status of the association
+        db.Index('ix_uc_association_user_name_status','user_name','status'),
+    )
 
-    def to_dict(self):
-        calendar=self.calendar.to_dict()
+    def to_dict(self,readable=True):
+        calendar=self.calendar.to_dict(readable)
         calendar["status"]=self.status
         return calendar
 
@@ -47,13 +54,19 @@ class Calendar(db.Model):
     id=db.Column(db.Integer,primary_key=True)
     name=db.Column(db.String(50),nullable=False)
     owned_by=db.Column(db.String(8),db.ForeignKey('user.name'),nullable=False)
+    #bumped by every write that changes an appointment of the calendar, part of the ETags of the calendar and its users
+    version=db.Column(db.Integer,nullable=False,default=1,server_default="1")
     invited=db.relationship('UC_Association',backref='calendar', cascade="all, delete", lazy=True)
-    appointments=db.relationship('CA_Association',backref='calendar', cascade="all, delete", lazy=True)
+    appointments=db.relationship('CA_Association',backref='calendar', cascade="all, delete", lazy=True, order_by='CA_Association.appointment_id')
+    __table_args__=(
+        #calendars are always addressed by their owner and name
+        db.Index('ix_calendar_owned_by_name','owned_by','name'),
+    )
 
-    def to_dict(self):
+    def to_dict(self,readable=True):
         appointments=[]
         for association in self.appointments:
-            appointments.append(association.to_dict())
+            appointments.append(association.to_dict(readable))
         return {
             "name":self.name,
             "owner":self.owned_by,
@@ -65,9 +78,13 @@ class CA_Association(db.Model):
     calendar_id=db.Column(db.Integer,db.ForeignKey("calendar.id"),primary_key=True)
     appointment_id=db.Column(db.Integer,db.ForeignKey("appointment.id"),primary_key=True)
     status=db.Column(db.String(20),default="pending")
+    __table_args__=(
+        #the primary key only covers lookups by calendar, this one covers the way back from an appointment
+        db.Index('ix_ca_association_appointment_id','appointment_id'),
+    )
 
-    def to_dict(self):
-        appointment=self.appointment.to_dict()
+    def to_dict(self,readable=True):
+        appointment=self.appointment.to_dict(readable=readable)
         appointment["status"]=self.status
         return appointment
 
@@ -77,16 +94,113 @@ class Appointment(db.Model):
     name=db.Column(db.String(100),nullable=False)
     date=db.Column(db.DateTime(),nullable=False)
     duration=db.Column(db.SmallInteger,nullable=False)
+    #unix timestamps of start and end of the (first) occurrence, kept in sync with date and duration by sync_epochs
+    start_epoch=db.Column(db.Integer)
+    end_epoch=db.Column(db.Integer)
     origin_id=db.Column(db.Integer,db.ForeignKey('calendar.id'),nullable=False)
+    #recurrence rule, see recurrence.py. Appointments with repeat None take place once.
+    repeat=db.Column(db.String(10))
+    repeat_count=db.Column(db.Integer)
+    repeat_until=db.Column(db.DateTime())
+    repeat_except=db.Column(db.Text)
     calendars=db.relationship('CA_Association',backref='appointment',cascade="all, delete",lazy=True)
+    __table_args__=(
+        #appointments are identified by (name, day, origin_id), so the equality columns come before the date range
+        db.Index('ix_appointment_origin_id_name_date','origin_id','name','date'),
+        db.Index('ix_appointment_start_epoch','start_epoch'),
+        #busy lookups select the appointments that end after and start before a window
+        db.Index('ix_appointment_end_epoch_start_epoch','end_epoch','start_epoch'),
+        #ids of deleted appointments are never reused, as the change log refers to appointments by id
+        {'sqlite_autoincrement':True},
+    )
     
     def __repr__(self):
         return 'Name '+self.name+'\ntakes place on '+self.date+' for '+str(self.duration)+' mins.\nCreated by '+self.owner_id+'.'
 
-    def to_dict(self):
-        return {
-            'name':self.name,
-            'datestamp':self.date.replace(tzinfo=datetime.timezone.utc).timestamp(),
-            'date':self.date.strftime("%Y/%m/%d %H:%M"),
-            'duration':self.duration
-        }
\ No newline at end of file
+    @db.validates('date','duration')
+    def sync_epochs(self,key,value):
+        """keeps start_epoch and end_epoch in sync whenever date or duration are set, the naive date is taken as UTC."""
+        date=value if key=='date' else self.date
+        duration=value if key=='duration' else self.duration
+        if date is not None:
+            self.start_epoch=epoch(date)
+            if duration is not None:
+                self.end_epoch=self.start_epoch+duration*60
+        return value
+
+    def to_dict(self,start=None,readable=True):
+        """serializes the appointment. start replaces the date for occurrences of recurring appointments.
+        Without readable, times are emitted as the stored unix timestamps only, without any datetime formatting."""
+        if readable:
+            if start is None:
+                start=self.date
+            appointment={
+                'name':self.name,
+                'datestamp':float(self.start_epoch if start is self.date else epoch(start)),
+                'date':start.strftime("%Y/%m/%d %H:%M"),
+                'duration':self.duration
+            }
+        else:
+            begin=self.start_epoch if start is None else epoch(start)
+            appointment={
+                'name':self.name,
+                'datestamp':begin,
+                'end':begin+self.duration*60,
+                'duration':self.duration
+            }
+        if self.repeat is not None:
+            exceptions=sorted(recurrence.parse_exceptions(self.repeat_except))
+            if readable:
+                appointment['recurrence']={
+                    'repeat':self.repeat,
+                    'count':self.repeat_count,
+                    'until':self.repeat_until.strftime("%Y/%m/%d %H:%M") if self.repeat_until is not None else None,
+                    'except':[day.strftime("%Y/%m/%d") for day in exceptions]
+                }
+            else:
+                appointment['recurrence']={
+                    'repeat':self.repeat,
+                    'count':self.repeat_count,
+                    'until':epoch(self.repeat_until) if self.repeat_until is not None else None,
+                    'except':[epoch(datetime.datetime.combine(day,datetime.time())) for day in exceptions]
+                }
+        return appointment
+
+    def occurrences(self,window_start=None,window_end=None):
+        """Generator yields the start datetimes of the occurrences of the appointment between window_start and window_end."""
+        return recurrence.occurrences(self.date,self.repeat,self.repeat_count,self.repeat_until,
+            recurrence.parse_exceptions(self.repeat_except),window_start,window_end)
+
+class Change(db.Model):
+    """Entry of the change log, written in the same transaction as the change it records. Its id orders the changes and is
+    the token of the sync endpoint. Appointments are referenced without foreign key, deleted appointments keep their entries."""
+    __tablename__='change_log'
+    id=db.Column(db.Integer,primary_key=True)
+    #'insertion', 'update', 'deletion', 'invitation' (of the calendar to an appointment), 'calendar' (new calendar) or 'calendar invite'
+    kind=db.Column(db.String(20),nullable=False)
+    calendar_id=db.Column(db.Integer,db.ForeignKey('calendar.id'),nullable=False)
+    appointment_id=db.Column(db.Integer)
+    #name and start of the appointment, which identify deleted appointments
+    name=db.Column(db.String(100))
+    start_epoch=db.Column(db.Integer)
+    #changes meant for a single user of the calendar, e.g. the invitation to a shared calendar
+    user_name=db.Column(db.String(20))
+    __table_args__=(
+        #changes are read per calendar of the syncing user after a token
+        db.Index('ix_change_log_calendar_id_id','calendar_id','id'),
+    )
+
+def epoch(date):
+    """returns the unix timestamp of a naive datetime in UTC as integer."""
+    return int(date.replace(tzinfo=datetime.timezone.utc).timestamp())
+
+def association_graph():
+    """Function returns the loader option that fetches everything serialized by UC_Association.to_dict along with the associations,
+    using one more query for the appointments of all their calendars instead of one per appointment."""
+    return db.joinedload(UC_Association.calendar).selectinload(Calendar.appointments).joinedload(CA_Association.appointment)
+
+def user_graph():
+    """Function returns the loader option that fetches everything serialized by User.to_dict along with the users.
+    The whole graph is loaded in a fixed number of queries, independent of the number of calendars and appointments."""
+    return db.selectinload(User.calendars).joinedload(UC_Association.calendar)\
+        .selectinload(Calendar.appointments).joinedload(CA_Association.appointment)
@@ -0,0 +1,67 @@
+"""Recurrence rules of appointments and their lazy expansion.
+
+A recurring appointment is stored as a single row holding its first occurrence and a rule: the frequency
+('daily', 'weekly' or 'monthly'), optionally bounded by a number of occurrences and/or a last date, and a list
+of days on which the occurrence is skipped. Occurrences are only generated for the window a query asks for."""
+import datetime
+
+FREQUENCIES=("daily","weekly","monthly")
+STEPS={"daily":datetime.timedelta(days=1),"weekly":datetime.timedelta(weeks=1)}
+
+def parse_exceptions(text):
+    """returns the set of dates stored as comma separated YYYY-MM-DD in the column repeat_except."""
+    if not text:
+        return set()
+    return {datetime.date.fromisoformat(day) for day in text.split(",")}
+
+def format_exceptions(days):
+    """formats dates for the column repeat_except, None if there are no dates."""
+    if not days:
+        return None
+    return ",".join(sorted(day.isoformat() for day in days))
+
+def add_months(dt,months):
+    """returns dt moved by months, or None if the day does not exist in the target month."""
+    month=dt.month-1+months
+    try:
+        return dt.replace(year=dt.year+month//12,month=month%12+1)
+    except ValueError:
+        return None
+
+def occurrences(start,repeat,count=None,until=None,exceptions=None,window_start=None,window_end=None):
+    """Generator yields the start datetimes of the occurrences of an appointment starting at start that lie between window_start and window_end.
+    Both bounds are inclusive and optional; a series without count or until is infinite, so callers have to bound it.
+    Daily and weekly series jump directly to the first occurrence in the window, so the cost only depends on the size of the window.
+    Monthly series skip months that do not have the day of start, like RFC 5545 does."""
+    if repeat is None:
+        if (window_start is None or start>=window_start) and (window_end is None or start<=window_end):
+            yield start
+        return
+    exceptions=exceptions or set()
+
+    if repeat=="monthly":
+        index,generated=0,0
+        while count is None or generated<count:
+            occurrence=add_months(start,index)
+            index+=1
+            if occurrence is None:
+                continue
+            generated+=1
+            if (until is not None and occurrence>until) or (window_end is not None and occurrence>window_end):
+                return
+            if (window_start is None or occurrence>=window_start) and occurrence.date() not in exceptions:
+                yield occurrence
+        return
+
+    step=STEPS[repeat]
+    index=0
+    if window_start is not None and window_start>start:
+        #index of the first occurrence at or after window_start
+        index=-((start-window_start)//step)
+    while count is None or index<count:
+        occurrence=start+index*step
+        if (until is not None and occurrence>until) or (window_end is not None and occurrence>window_end):
+            return
+        if occurrence.date() not in exceptions:
+            yield occurrence
+        index+=1
@@ -0,0 +1,53 @@
+import asyncio, json, re
+import api, asgi, migrations
+from models import db
+
+def request(method,path,body=b"",content_type="application/x-www-form-urlencoded"):
+    """sends a request to the ASGI app and returns (status, body)."""
+    path,_,query=path.partition("?")
+    scope={"type":"http","http_version":"1.1","method":method,"path":path,"raw_path":path.encode(),"root_path":"","scheme":"http",
+        "query_string":query.encode(),"headers":[(b"content-type",content_type.encode())],"client":("127.0.0.1",1),"server":("testserver",80)}
+    messages=[{"type":"http.request","body":body,"more_body":False}]
+    sent=[]
+    async def receive():
+        return messages.pop(0) if messages else {"type":"http.disconnect"}
+    async def send(message):
+        sent.append(message)
+    asyncio.run(asgi.app(scope,receive,send))
+    status=next(message["status"] for message in sent if message["type"]=="http.response.start")
+    return status,b"".join(message.get("body",b"") for message in sent if message["type"]=="http.response.body")
+
+def sample(metrics,name,**labels):
+    """returns the value of the sample of the metric with the labels, 0 if there is none."""
+    selector=",".join(f'{key}="{value}"' for key,value in labels.items())
+    match=re.search(rf"^{name}{{{re.escape(selector)}}} (\S+)$",metrics,re.MULTILINE)
+    return float(match.group(1)) if match else 0
+
+def test_metrics_count_asgi_requests_and_their_sql(app):
+    assert request("POST","/users",b"user=alice")[0]==200
+    status,before=request("GET","/metrics")
+    assert status==200
+    assert request("GET","/user/alice")[0]==200
+    assert request("GET","/user/nobody")[0]==404
+    metrics=request("GET","/metrics")[1].decode()
+    assert sample(metrics,"calendar_requests_total",endpoint="user",method="GET",status="200")-sample(before.decode(),"calendar_requests_total",endpoint="user",method="GET",status="200")==1
+    assert sample(metrics,"calendar_requests_total",endpoint="user",method="GET",status="404")-sample(before.decode(),"calendar_requests_total",endpoint="user",method="GET",status="404")==1
+    #the statements run in the thread pool are attributed to the requests: the ETag and the calendars of alice, the lookup of the missing user
+    assert sample(metrics,"calendar_sql_queries_total",endpoint="user")-sample(before.decode(),"calendar_sql_queries_total",endpoint="user")==3
+    assert sample(metrics,"calendar_request_duration_seconds_count",endpoint="user")>=2
+
+def test_startup_upgrades_the_database(tmp_path,monkeypatch):
+    monkeypatch.setitem(api.app.config,"SQLALCHEMY_DATABASE_URI",f"sqlite:///{tmp_path}/calendar.db")
+    messages=[{"type":"lifespan.startup"},{"type":"lifespan.shutdown"}]
+    sent=[]
+    async def receive():
+        return messages.pop(0)
+    async def send(message):
+        sent.append(message)
+    asyncio.run(asgi.app({"type":"lifespan"},receive,send))
+    assert [message["type"] for message in sent]==["lifespan.startup.complete","lifespan.shutdown.complete"]
+    assert request("POST","/users",b"user=alice")[0]==200
+    with api.app.app_context():
+        with db.engine.begin() as connection:
+            assert migrations.current_version(connection)==migrations.MIGRATIONS[-1][0]
+        db.engine.dispose()
@@ -0,0 +1,40 @@
+import datetime, random
+from concurrent.futures import ThreadPoolExecutor
+import api
+from benchmark import overlapping
+from conftest import add_user
+
+#monday 2030-01-07 00:00 UTC
+MONDAY=1893974400
+
+def test_concurrent_bookings_never_double_book(app,client):
+    names=[f"user{i}" for i in range(4)]
+    for name in names:
+        add_user(client,name)
+    rng=random.Random(0)
+    #every booking competes with the others for the same four users on the same morning
+    requests=[(*rng.sample(names,2),MONDAY+9*3600+15*60*rng.randrange(16)) for _ in range(120)]
+    def book(request):
+        host,guest,start=request
+        return app.test_client().post(f"/book/{host}/main",data={"user":guest,"name":"contended","start":start,"dur":30}).status_code
+    with ThreadPoolExecutor(8) as pool:
+        statuses=list(pool.map(book,requests))
+    assert set(statuses)<={200,400},statuses
+    assert statuses.count(200)>0
+    assert overlapping(api,names)==0
+
+def test_long_appointments_block_every_day_they_cover(app,client):
+    add_user(client,"alice")
+    add_user(client,"bob")
+    #from wednesday 2030-01-02 09:00 to tuesday 2030-01-08 17:00, across two weeks of the busy cache
+    event=b"BEGIN:VCALENDAR\r\nBEGIN:VEVENT\r\nSUMMARY:conference\r\nDTSTART:20300102T090000Z\r\nDTEND:20300108T170000Z\r\nEND:VEVENT\r\nEND:VCALENDAR\r\n"
+    assert client.post("/appointments/bob/main",data=event,content_type="text/calendar").status_code==200
+    conference=(1893574800,1894122000)
+    with app.app_context():
+        assert api.load_busy("bob",MONDAY+7*3600,MONDAY+8*3600)==[conference]
+        #the cache serves the interval from the buckets of both weeks
+        for day in range(7):
+            start=datetime.datetime(2030,1,2,12)+datetime.timedelta(days=day)
+            assert api.busy_intervals("bob",start,start+datetime.timedelta(hours=1))==[conference]
+    response=client.post("/book/alice/main",data={"user":"bob","name":"review","start":MONDAY+10*3600,"dur":30})
+    assert response.status_code==400,response.get_json()
@@ -0,0 +1,33 @@
+import io
+from flask_sqlalchemy import get_debug_queries
+import api
+from conftest import add_user
+from models import db
+
+def calendar(events):
+    """returns an iCalendar text with a single event per (name, start) in events."""
+    lines=["BEGIN:VCALENDAR","VERSION:2.0"]
+    for name,start in events:
+        lines+=["BEGIN:VEVENT",f"SUMMARY:{name}",f"DTSTART:{start}","DURATION:PT30M","END:VEVENT"]
+    return ("\r\n".join(lines+["END:VCALENDAR"])+"\r\n").encode()
+
+def test_import_and_export(client):
+    add_user(client,"alice")
+    text=calendar([(f"meeting {day}",f"203001{day:02}T090000Z") for day in range(1,29)])
+    response=client.post("/appointments/alice/main",input_stream=io.BytesIO(text),content_type="text/calendar",headers={"Content-Length":str(len(text))})
+    assert response.get_json()=={"type":"import","inserted":28,"updated":0,"skipped":0,"errors":[]}
+    exported=client.get("/appointments/alice/main",headers={"Accept":"text/calendar"}).get_data(as_text=True)
+    assert exported.count("BEGIN:VEVENT")==28
+    assert "SUMMARY:meeting 7\r\n" in exported and "DTSTART:20300107T090000Z\r\n" in exported
+
+def test_import_keeps_one_batch_of_recorded_statements(app,client,monkeypatch):
+    #Flask-SQLAlchemy records every statement in debug mode, an import drops them after each batch
+    assert app.debug
+    monkeypatch.setitem(app.config,"ICS_IMPORT_BATCH",10)
+    add_user(client,"alice")
+    text=calendar([(f"meeting {day}",f"2030{month:02}{day:02}T090000Z") for month in range(1,11) for day in range(1,11)])
+    with app.test_request_context():
+        result,status=api.import_calendar("alice","main",iter([text]))
+        assert status==200 and result["inserted"]==100
+        db.session.execute("SELECT 1")
+        assert [query.statement for query in get_debug_queries()]==["SELECT 1"]
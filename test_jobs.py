@@ -0,0 +1,40 @@
+import threading, time
+import pytest
+import api
+from jobs import Jobs
+from conftest import add_user
+
+START=1893488400
+
+@pytest.fixture
+def jobs(app,monkeypatch):
+    """a single worker, which is kept busy until the returned event is set."""
+    monkeypatch.setattr(api,"jobs",Jobs(app,max_workers=1))
+    busy=threading.Event()
+    api.jobs.submit("blocker",1,lambda progress:busy.wait(10))
+    yield busy
+    busy.set()
+
+def finished(client,job_id):
+    """waits for the job to finish and returns its status."""
+    for _ in range(500):
+        job=client.get(f"/jobs/{job_id}").get_json()
+        if job["state"] in ("done","failed"):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not finish")
+
+def test_invitation_to_deleted_appointment(client,jobs):
+    for name in ("alice","bob","carol"):
+        add_user(client,name)
+    assert client.post("/appointments/alice/main",data={"name":"standup","start":START,"dur":30}).status_code==200
+    token=client.get("/sync/bob").get_json()["token"]
+    response=client.post("/bulk/invite/alice/main",data={"user":["bob","carol"],"name":"standup","start":START})
+    assert response.status_code==202
+    assert client.delete("/appointments/alice/main",data={"name":"standup","start":START}).status_code==200
+    jobs.set()
+    job=finished(client,response.get_json()["job"]["id"])
+    assert job["state"]=="done" and job["result"]["invited"]==0
+    assert job["result"]["errors"]==["appointment 'standup' was deleted, the guests from 'bob' on were not invited"]
+    assert client.get("/user/bob").status_code==200
+    assert client.get("/sync/bob",query_string={"since":token}).get_json()["changes"]==[]
@@ -0,0 +1,80 @@
+import re, shutil
+import pytest
+from sqlalchemy import create_engine, inspect
+import api, migrations
+from models import db
+from conftest import add_user
+
+LATEST=migrations.MIGRATIONS[-1][0]
+
+def schema(engine):
+    """returns the columns, index names and whether ids are AUTOINCREMENT of the tables declared in models.py."""
+    inspector=inspect(engine)
+    definitions=dict(engine.execute("SELECT name, sql FROM sqlite_master WHERE type='table'").fetchall())
+    return {table:(sorted((column["name"],str(column["type"]),column["nullable"]) for column in inspector.get_columns(table)),
+        sorted(index["name"] for index in inspector.get_indexes(table)),"AUTOINCREMENT" in definitions[table])
+        for table in db.metadata.tables}
+
+@pytest.mark.parametrize("source",["shipped","empty"])
+def test_upgrade_matches_models(tmp_path,source):
+    if source=="shipped":
+        shutil.copy("calendar.db",tmp_path/"upgraded.db")
+    upgraded=create_engine(f"sqlite:///{tmp_path}/upgraded.db")
+    assert migrations.upgrade(upgraded)==LATEST
+    assert migrations.upgrade(upgraded)==LATEST
+    created=create_engine(f"sqlite:///{tmp_path}/created.db")
+    db.metadata.create_all(created)
+    assert schema(upgraded)==schema(created)
+
+def test_hot_lookups_use_indexes(client,app,statements):
+    add_user(client,"alice",("work","home"))
+    add_user(client,"bob")
+    assert client.post("/share/alice/work",data={"user":"bob"}).status_code==200
+    assert client.post("/appointments/alice/work",data={"name":"Standup","start":1893488400,"dur":30}).status_code==200
+    with app.test_request_context():
+        del statements[:]
+        calendar=api.resolve_calendar("alice","work")
+        api.resolve_user("bob")
+        api.default_calendar_id("bob")
+        appointment=api.check_appointment("Standup",api.freebusy.from_unix(1893488400),calendar.id)
+        api.users_of([calendar.id],[appointment.id])
+        lookups=list(statements)
+        assert len(lookups)==5
+        connection=db.session.connection()
+        for statement,parameters in lookups:
+            plan=[row[-1] for row in connection.execute("EXPLAIN QUERY PLAN "+statement,parameters)]
+            scans=[step for step in plan if re.match(r"SCAN \w+$",step)]
+            assert scans==[],f"{statement} scans a whole table: {plan}"
+
+def test_mysql_reserved_words_are_quoted(monkeypatch):
+    from sqlalchemy.dialects import mysql
+    class Connection(object):
+        dialect=mysql.dialect()
+        def __init__(self):
+            self.statements=[]
+        def execute(self,statement):
+            self.statements.append(statement)
+    class Inspector(object):
+        get_columns=get_indexes=lambda self,table:[]
+    monkeypatch.setattr(migrations,"inspect",lambda connection:Inspector())
+    connection=Connection()
+    migrations.appointment_recurrence(connection)
+    migrations.create_missing_indexes(connection,[('ix_appointment_repeat','appointment',('repeat',))])
+    assert "ALTER TABLE appointment ADD COLUMN `repeat` VARCHAR(10)" in connection.statements
+    assert "CREATE INDEX ix_appointment_repeat ON appointment (`repeat`)" in connection.statements
+
+def test_failed_migration_is_rolled_back(tmp_path,monkeypatch):
+    engine=create_engine(f"sqlite:///{tmp_path}/calendar.db")
+    migrations.upgrade(engine,7)
+    def fail(connection):
+        raise RuntimeError("simulated failure")
+    #the last step of migration 8, after the appointment table has been rebuilt
+    monkeypatch.setattr(migrations,"fulltext_triggers",fail)
+    with pytest.raises(RuntimeError):
+        migrations.upgrade(engine)
+    tables=inspect(engine).get_table_names()
+    assert "appointment_rebuilt" not in tables and "appointment" in tables
+    with engine.connect() as connection:
+        assert migrations.current_version(connection)==7
+    monkeypatch.undo()
+    assert migrations.upgrade(engine)==LATEST
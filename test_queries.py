@@ -0,0 +1,67 @@
+import pytest
+from conftest import add_user
+
+START=1893488400
+
+def populate(client,users,appointments):
+    """creates users with two calendars each, shares one of them with the next user and fills them with appointments."""
+    for i in range(users):
+        add_user(client,f"user{i}",("work","home"))
+    for i in range(users):
+        assert client.post(f"/share/user{i}/home",data={"user":f"user{(i+1)%users}"}).status_code==200
+        for j in range(appointments):
+            calendar=("work","home")[j%2]
+            assert client.post(f"/appointments/user{i}/{calendar}",data={"name":f"meeting {j}","start":START+j*86400,"dur":30}).status_code==200
+
+def count(client,statements,method,url,data=None,status=200):
+    """returns the number of statements a request runs."""
+    del statements[:]
+    response=client.open(url,method=method,data=data)
+    assert response.status_code==status,response.get_data(as_text=True)
+    return len(statements)
+
+@pytest.mark.parametrize("users,appointments",[(2,2),(6,12)])
+def test_reads_run_fixed_number_of_queries(client,statements,users,appointments):
+    populate(client,users,appointments)
+    #users, their calendars, the calendars' appointments
+    assert count(client,statements,"GET","/users")==3
+    #the ETag query loading the user, the user's calendars, their appointments
+    assert count(client,statements,"GET","/user/user1")==3
+    #the user, the calendar, its appointments
+    assert count(client,statements,"GET","/appointments/user1/work")==3
+
+@pytest.fixture(params=[(2,2),(6,12)],ids=["small","large"])
+def populated(request,client,statements):
+    users,appointments=request.param
+    populate(client,users,appointments)
+    add_user(client,"guest",())
+    return client
+
+def test_create_user(populated,statements):
+    #the existence check, the insert
+    assert count(populated,statements,"POST","/users",{"user":"newcomer"})==2
+
+def test_create_calendar(populated,statements):
+    #the user, the name check, the default calendar check, the calendar, its association, the change log, the user version
+    assert count(populated,statements,"POST","/user/guest",{"calendar":"first"})==7
+    assert count(populated,statements,"POST","/user/guest",{"calendar":"second"})==7
+
+def test_save_appointment(populated,statements):
+    #the user, the calendar, the appointment lookup, the appointment, its association, the change log, the users of the calendar, the calendar version
+    assert count(populated,statements,"POST","/appointments/user0/work",{"name":"review","start":START+400*86400,"dur":30})==8
+    #as above, with the update instead of the inserts
+    assert count(populated,statements,"POST","/appointments/user0/work",{"name":"review","start":START+400*86400,"dur":45})==7
+
+def test_delete_appointment(populated,statements):
+    populated.post("/appointments/user0/work",data={"name":"review","start":START+400*86400,"dur":30})
+    #the user, the calendar, the appointment, the users of the calendars, their versions, the change log, the associations, the two deletes
+    assert count(populated,statements,"DELETE","/appointments/user0/work",{"name":"review","start":START+400*86400})==9
+
+def test_book_appointment(populated,statements):
+    #the users and the calendar, the busy intervals of both users before and after the lock, the guest's default calendar,
+    #the users of both calendars, their lock, the appointment, its associations, the change log entries and the calendar versions
+    assert count(populated,statements,"POST","/book/user0/work",{"user":"user1","name":"sync","start":START+300*86400,"dur":30})==15
+
+def test_share_calendar(populated,statements):
+    #the users, the calendar, its appointments for the response, the association, the change log, the user version
+    assert count(populated,statements,"POST","/share/user0/work",{"user":"guest"})==7
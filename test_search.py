@@ -0,0 +1,13 @@
+from conftest import add_user
+
+START=1893488400
+
+def test_ranked_search_within_window_keeps_rank_order(client):
+    add_user(client,"alice")
+    #the longer name matches the search worse, although it takes place first
+    assert client.post("/appointments/alice/main",data={"name":"budget planning and hiring review","start":START,"dur":30}).status_code==200
+    assert client.post("/appointments/alice/main",data={"name":"planning","start":START+86400,"dur":30,"repeat":"weekly"}).status_code==200
+    response=client.post("/search/alice",data={"name":"plan","start":START,"days_ahead":14})
+    assert response.status_code==200
+    assert [(appointment["name"],appointment["datestamp"]) for appointment in response.get_json()["appointments"]]==[
+        ("planning",START+86400),("planning",START+8*86400),("budget planning and hiring review",START)]
@@ -0,0 +1,20 @@
+import pytest
+from models import db
+from conftest import add_user
+
+START=1893488400
+
+@pytest.mark.parametrize("reused",[False,True],ids=["new id","reused id"])
+def test_deletion_followed_by_insertion(app,client,reused):
+    add_user(client,"alice")
+    assert client.post("/appointments/alice/main",data={"name":"standup","start":START,"dur":30}).status_code==200
+    token=client.get("/sync/alice").get_json()["token"]
+    assert client.delete("/appointments/alice/main",data={"name":"standup","start":START}).status_code==200
+    if reused:
+        #databases that reuse ids, like SQLite without AUTOINCREMENT, give the id of the deleted appointment to the next one
+        with app.app_context():
+            db.session.execute("DELETE FROM sqlite_sequence WHERE name='appointment'")
+            db.session.commit()
+    assert client.post("/appointments/alice/main",data={"name":"review","start":START+3600,"dur":30}).status_code==200
+    changes=client.get("/sync/alice",query_string={"since":token}).get_json()["changes"]
+    assert [(change["type"],change["appointment"]["name"]) for change in changes]==[("deletion","standup"),("insertion","review")]